@@ -1,7 +1,7 @@
 from discord.ext import commands
 import logging
 from utils import Config, permission_node
-from .utils import isUp, sendCmd
+from .utils import isUp, sendCmd, sendCmdCapture, fanout, closeRconPools
 
 log = logging.getLogger('charfred')
 
@@ -16,6 +16,9 @@ class ConsoleCmds(commands.Cog):
         if 'defaultcategory' not in self.servercfg:
             self.servercfg['defaultcategory'] = ''
 
+    def cog_unload(self):
+        closeRconPools()
+
     @commands.group(aliases=['mc'], invoke_without_command=True)
     @permission_node(f'{__name__}.whitelist')
     async def minecraft(self, ctx):
@@ -47,15 +50,18 @@ class ConsoleCmds(commands.Cog):
         else:
             servers = self.servercfg['servers']
 
-        msg = ['Command Log', '==========', f'> Category: {category}' if category else '']
-        for server in servers:
-            if isUp(server):
+        async def _whitelist(server):
+            if isUp(server, self.servercfg['serverspath']):
                 log.info(f'Whitelisting {player} on {server}.')
-                await sendCmd(self.loop, server, f'whitelist add {player}')
-                msg.append(f'# Whitelisted {player} on {server}.')
+                await sendCmd(self.loop, server, f'whitelist add {player}',
+                              servercfg=self.servercfg)
+                return f'# Whitelisted {player} on {server}.'
             else:
                 log.warning(f'Could not whitelist {player} on {server}.')
-                msg.append(f'< Unable to whitelist {player}, {server} is offline! >')
+                return f'< Unable to whitelist {player}, {server} is offline! >'
+
+        msg = ['Command Log', '==========', f'> Category: {category}' if category else '']
+        msg.extend(await fanout(self.loop, servers, _whitelist))
         await ctx.sendmarkdown('\n'.join(msg))
 
     @whitelist.command()
@@ -75,15 +81,18 @@ class ConsoleCmds(commands.Cog):
         else:
             servers = self.servercfg['servers']
 
-        msg = ['Command Log', '==========', f'> Category: {category}' if category else '']
-        for server in servers:
-            if isUp(server):
+        async def _unwhitelist(server):
+            if isUp(server, self.servercfg['serverspath']):
                 log.info(f'Unwhitelisting {player} on {server}.')
-                await sendCmd(self.loop, server, f'whitelist remove {player}')
-                msg.append(f'# Unwhitelisting {player} on {server}.')
+                await sendCmd(self.loop, server, f'whitelist remove {player}',
+                              servercfg=self.servercfg)
+                return f'# Unwhitelisting {player} on {server}.'
             else:
                 log.warning(f'Could not unwhitelist {player} on {server}.')
-                msg.append(f'< Unable to unwhitelist {player}, {server} is offline! >')
+                return f'< Unable to unwhitelist {player}, {server} is offline! >'
+
+        msg = ['Command Log', '==========', f'> Category: {category}' if category else '']
+        msg.extend(await fanout(self.loop, servers, _unwhitelist))
         await ctx.sendmarkdown('\n'.join(msg))
 
     @whitelist.command()
@@ -196,9 +205,9 @@ class ConsoleCmds(commands.Cog):
         """
 
         msg = ['Command Log', '==========']
-        if isUp(server):
+        if isUp(server, self.servercfg['serverspath']):
             log.info(f'Kicking {player} from {server}.')
-            await sendCmd(self.loop, server, f'kick {player}')
+            await sendCmd(self.loop, server, f'kick {player}', servercfg=self.servercfg)
             msg.append(f'# Kicked {player} from {server}.')
         else:
             msg.append(f'< {server} is not online! >')
@@ -209,17 +218,20 @@ class ConsoleCmds(commands.Cog):
     async def ban(self, ctx, player: str):
         """Bans a player, and unwhitelists just to be safe."""
 
-        msg = ['Command Log', '==========']
-        for server in self.servercfg['servers']:
-            if isUp(server):
+        async def _ban(server):
+            if isUp(server, self.servercfg['serverspath']):
                 log.info(f'Banning {player} on {server}.')
-                await sendCmd(self.loop, server, f'ban {player}')
+                await sendCmd(self.loop, server, f'ban {player}', servercfg=self.servercfg)
                 log.info(f'Unwhitelisting {player} on {server}.')
-                await sendCmd(self.loop, server, f'whitelist remove {player}')
-                msg.append(f'# Banned {player} from {server}.')
+                await sendCmd(self.loop, server, f'whitelist remove {player}',
+                              servercfg=self.servercfg)
+                return f'# Banned {player} from {server}.'
             else:
                 log.warning(f'Could not ban {player} from {server}.')
-                msg.append(f'< Unable to ban {player}, {server} is offline! >')
+                return f'< Unable to ban {player}, {server} is offline! >'
+
+        msg = ['Command Log', '==========']
+        msg.extend(await fanout(self.loop, self.servercfg['servers'], _ban))
         await ctx.sendmarkdown('\n'.join(msg))
 
     @minecraft.command(aliases=['pass'])
@@ -231,10 +243,12 @@ class ConsoleCmds(commands.Cog):
         """
 
         msg = ['Command Log', '==========']
-        if isUp(server):
+        if isUp(server, self.servercfg['serverspath']):
             log.info(f'Relaying \"{command}\" to {server}.')
-            await sendCmd(self.loop, server, command)
+            response = await sendCmdCapture(self.loop, server, command, self.servercfg)
             msg.append(f'# Relayed \"{command}\" to {server}.')
+            if response:
+                msg.append(response if len(response) < 1800 else (response[:1800] + ' [...]'))
         else:
             log.warning(f'Could not relay \"{command}\" to {server}.')
             msg.append(f'< Unable to relay command, {server} is offline! >')
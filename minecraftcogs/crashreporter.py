@@ -1,9 +1,12 @@
 from discord.ext import commands
 import logging
 import asyncio
+import os
+from time import strftime, localtime
 from discord import File
-from utils import permission_node
-from .utils import getcrashreport, parsereport, formatreport
+from utils import Config, permission_node
+from .utils import getcrashreport, getCrashIndex, parsereport, formatreport, recordCrash, \
+    describeCrash
 
 log = logging.getLogger('charfred')
 
@@ -13,8 +16,9 @@ class CrashReporter(commands.Cog):
         self.bot = bot
         self.loop = bot.loop
         self.servercfg = bot.servercfg
+        self.crashsigs = bot.crashsigs
 
-    @commands.command(aliases=['report', 'crashreports'])
+    @commands.group(invoke_without_command=True, aliases=['report', 'crashreports'])
     @permission_node(f'{__name__}.report')
     async def crashreport(self, ctx, server: str, nthlast: int=0):
         """Retrieves the last crashreport for the given server.
@@ -28,7 +32,9 @@ class CrashReporter(commands.Cog):
 
         log.info(f'Getting report for {server}.')
         serverspath = self.servercfg['serverspath']
-        rpath, _ = await self.loop.run_in_executor(None, getcrashreport, server, serverspath, nthlast)
+        rpath, mtime = await self.loop.run_in_executor(
+            None, getcrashreport, server, serverspath, nthlast
+        )
 
         b, _, timedout = await ctx.promptconfirm('Do you wish to download the full report?')
         if timedout:
@@ -41,21 +47,80 @@ class CrashReporter(commands.Cog):
             return
 
         log.info('Parsing report...')
-        ctime, desc, strace, flavor, level, block, phase = await self.loop.run_in_executor(
+        ctime, desc, strace, flavor, level, block, phase, threads = await self.loop.run_in_executor(
             None, parsereport, rpath
         )
 
+        sig, entry = recordCrash(self.crashsigs, server, os.path.basename(rpath),
+                                 mtime, strace, desc)
+        await self.crashsigs.save()
+
         log.info('Formatting report...')
         chunks = await self.loop.run_in_executor(
-            None, formatreport, rpath, ctime, desc, flavor, strace, level, block, phase
+            None, formatreport, rpath, ctime, desc, flavor, strace, level, block, phase, threads
         )
+        chunks[0] += '\n' + describeCrash(sig, entry)
 
         for c in chunks:
             await ctx.sendmarkdown(c)
             await asyncio.sleep(1, loop=self.loop)
         log.info('Report sent!')
 
+    @crashreport.command()
+    async def stats(self, ctx, server: str):
+        """Lists how often each known crash has occurred on a server.
+
+        Crashes are told apart by the signature of their stacktraces,
+        reports not fingerprinted yet are fingerprinted first.
+        """
+
+        if server not in self.servercfg['servers']:
+            await ctx.sendmarkdown(f'< I have no knowledge of {server}! >')
+            return
+
+        recorded = self.crashsigs[server]['reports'] if server in self.crashsigs else {}
+
+        def _unrecorded():
+            index = getCrashIndex(self.servercfg['serverspath'] + f'/{server}/crash-reports')
+            reports = []
+            for rpath, mtime in reversed(index.reports()):
+                if os.path.basename(rpath) in recorded:
+                    continue
+                try:
+                    _, desc, strace, *_ = parsereport(rpath)
+                except OSError:
+                    continue
+                reports.append((rpath, mtime, strace, desc))
+            return reports
+
+        log.info(f'Fingerprinting reports of {server}...')
+        reports = await self.loop.run_in_executor(None, _unrecorded)
+        for rpath, mtime, strace, desc in reports:
+            recordCrash(self.crashsigs, server, os.path.basename(rpath), mtime, strace, desc)
+        if reports:
+            await self.crashsigs.save()
+
+        if server not in self.crashsigs or not self.crashsigs[server]['sigs']:
+            await ctx.sendmarkdown(f'> No crashes recorded for {server}.')
+            return
+        sigs = sorted(self.crashsigs[server]['sigs'].items(),
+                      key=lambda s: s[1]['count'], reverse=True)
+        title = f'Crash signatures of {server}'
+        msg = [title, '=' * len(title)]
+        for sig, entry in sigs[:15]:
+            last = strftime('%Y-%m-%d %H:%M', localtime(entry['last']))
+            msg.append(f'# {entry["count"]}x {sig}, last at {last}')
+            msg.append(f'\t{entry["exception"]}')
+            if entry['frame']:
+                msg.append(f'\tat {entry["frame"]}')
+        if len(sigs) > 15:
+            msg.append(f'> And {len(sigs) - 15} more.')
+        await ctx.sendmarkdown('\n'.join(msg))
+
 
 def setup(bot):
+    if not hasattr(bot, 'crashsigs'):
+        bot.crashsigs = Config(f'{bot.dir}/configs/crashsigs.json',
+                               load=True, loop=bot.loop)
     bot.register_nodes([f'{__name__}.report'])
     bot.add_cog(CrashReporter(bot))
@@ -3,7 +3,7 @@ from discord.utils import find
 import re
 import logging
 from utils import Config, permission_node
-from .utils import isUp, sendCmd
+from .utils import isUp, sendCmdCapture, fanout, closeRconPools
 
 log = logging.getLogger('charfred')
 
@@ -19,6 +19,9 @@ class Customs(commands.Cog):
             load=True
         )
 
+    def cog_unload(self):
+        closeRconPools()
+
     @commands.group(invoke_without_command=True, aliases=['cc'])
     @permission_node(f'{__name__}.custom')
     async def custom(self, ctx):
@@ -116,24 +119,30 @@ class Customs(commands.Cog):
             _cmd = _cmd.format(*args)
         msg.append(f'# Executing \"{_cmd}\"...')
 
-        if re.match('^all$', server, flags=re.I):
-            for server in self.servercfg['servers']:
-                if isUp(server):
-                    log.info(f'Executing \"{cmd}\" on {server}.')
-                    await sendCmd(self.loop, server, _cmd)
-                    msg.append(f'# on {server};')
-                else:
-                    log.warning(f'Could not execute \"{cmd}\", {server} is offline!')
-                    msg.append(f'< {server} is offline! >')
-        else:
-            if isUp(server):
+        async def _run(server):
+            if isUp(server, self.servercfg['serverspath']):
                 log.info(f'Executing \"{cmd}\" on {server}.')
-                await sendCmd(self.loop, server, _cmd)
-                msg.append(f'# on {server};')
+                response = await sendCmdCapture(self.loop, server, _cmd, self.servercfg)
+                if response:
+                    if len(response) > 1800:
+                        response = response[:1800] + ' [...]'
+                    return f'# on {server};\n{response}'
+                return f'# on {server};'
             else:
                 log.warning(f'Could not execute \"{cmd}\", {server} is offline!')
-                msg.append(f'< {server} is offline! >')
-        await ctx.sendmarkdown('\n'.join(msg))
+                return f'< {server} is offline! >'
+
+        if re.match('^all$', server, flags=re.I):
+            msg.extend(await fanout(self.loop, self.servercfg['servers'], _run))
+        else:
+            msg.append(await _run(server))
+        chunk = ''
+        for line in '\n'.join(msg).split('\n'):
+            if len(chunk) + len(line) > 1900:
+                await ctx.sendmarkdown(chunk)
+                chunk = ''
+            chunk += '\n' + line
+        await ctx.sendmarkdown(chunk)
 
 
 def setup(bot):
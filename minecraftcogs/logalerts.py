@@ -0,0 +1,217 @@
+from discord.ext import commands
+import logging
+import re
+from time import monotonic, strftime, localtime
+from utils import Config, permission_node
+from .utils import subscribeLog
+
+log = logging.getLogger('charfred')
+
+severities = ('info', 'warning', 'critical')
+
+
+# Backreferences, named groups and global flags do not survive being
+# joined with other patterns, rules using them are matched on their own.
+standalonepat = re.compile(r'\\(?:[1-9]|g<)|\(\?P[<=]|\(\?[aiLmsux]+\)')
+
+
+class AlertMatcher:
+    """All alert rules of a server compiled into a single regex,
+    so each log line is tested once, no matter how many rules there are.
+
+    Each rule becomes a named alternative, lastgroup then tells which
+    rule matched; if several would, the leftmost match wins.
+    Rules that cannot be joined are compiled on their own and only
+    tried if none of the joined ones matched.
+    """
+
+    def __init__(self, rules):
+        self.names = []
+        self.standalone = []
+        parts = []
+        for name, rule in rules.items():
+            pattern = rule['pattern'] if rule['regex'] else re.escape(rule['pattern'])
+            if rule['regex'] and standalonepat.search(pattern):
+                self.standalone.append((name, re.compile(pattern)))
+                continue
+            parts.append(f'(?P<_r{len(self.names)}>{pattern})')
+            self.names.append(name)
+        self.regex = re.compile('|'.join(parts)) if parts else None
+
+    def match(self, line):
+        """Returns the name of the rule matching a given line, or None."""
+
+        if self.regex is not None:
+            m = self.regex.search(line)
+            if m is not None:
+                return self.names[int(m.lastgroup[2:])]
+        for name, regex in self.standalone:
+            if regex.search(line):
+                return name
+        return None
+
+
+class LogAlerts(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.loop = bot.loop
+        self.servercfg = bot.servercfg
+        self.alertcfg = Config(f'{bot.dir}/configs/logalerts.json',
+                               load=True, loop=self.loop)
+        if 'rules' not in self.alertcfg:
+            self.alertcfg['rules'] = {}
+        self.watchers = {}
+        self.lastfired = {}
+        self.suppressed = {}
+        for server in self.alertcfg['rules']:
+            self._rewatch(server)
+
+    def cog_unload(self):
+        for task in self.watchers.values():
+            task.cancel()
+
+    def _rewatch(self, server):
+        """(Re)starts the watcher of a server with its current rules."""
+
+        task = self.watchers.pop(server, None)
+        if task:
+            task.cancel()
+        rules = self.alertcfg['rules'].get(server)
+        if not rules:
+            return
+        try:
+            matcher = AlertMatcher(rules)
+        except re.error as e:
+            log.warning(f'LA: Invalid alert rules for {server}: {e}')
+            return
+        self.watchers[server] = self.loop.create_task(self._watch(server, matcher))
+
+    async def _watch(self, server, matcher):
+        log.info(f'LA: Watching {server}\'s log for alerts.')
+        sub = subscribeLog(self.servercfg['serverspath'] + f'/{server}/logs/latest.log',
+                           self.loop)
+        try:
+            async for line in sub:
+                name = matcher.match(line)
+                if name:
+                    self._fire(server, name, line)
+        finally:
+            sub.close()
+            log.info(f'LA: Stopped watching {server}\'s log for alerts.')
+
+    def _fire(self, server, name, line):
+        rule = self.alertcfg['rules'][server][name]
+        key = (server, name)
+        now = monotonic()
+        if key in self.lastfired and now < self.lastfired[key] + rule['cooldown']:
+            self.suppressed[key] = self.suppressed.get(key, 0) + 1
+            return
+        self.lastfired[key] = now
+        suppressed = self.suppressed.pop(key, 0)
+        channel = self.bot.get_channel(rule['channel'])
+        if channel is None:
+            log.warning(f'LA: Channel for alert {name} on {server} not found!')
+            return
+        if len(line) > 1500:
+            line = line[:1500] + ' [...]'
+        if rule['severity'] == 'info':
+            msg = f'# {strftime("%H:%M", localtime())} : {server} : {name}\n{line}'
+        else:
+            msg = (f'< {strftime("%H:%M", localtime())} : {server} : {name}'
+                   f' ({rule["severity"]}) >\n{line}')
+        if suppressed:
+            msg += f'\n> {suppressed} more since the last alert.'
+        log.info(f'LA: {name} on {server}!')
+        self.loop.create_task(channel.send(f'```markdown\n{msg}\n```'))
+
+    @commands.group(invoke_without_command=True, aliases=['alerts'])
+    @permission_node(f'{__name__}.alerts')
+    async def logalert(self, ctx):
+        """Log alert commands.
+
+        This returns a list of all alert rules,
+        if no subcommand was given.
+        """
+
+        if not any(self.alertcfg['rules'].values()):
+            await ctx.sendmarkdown('> No alert rules configured!')
+            return
+        msg = ['Log Alert Rules', '===============']
+        for server, rules in self.alertcfg['rules'].items():
+            for name, rule in rules.items():
+                pattern = f'/{rule["pattern"]}/' if rule['regex'] else rule['pattern']
+                channel = self.bot.get_channel(rule['channel'])
+                msg.append(f'# {server}: {name} ({rule["severity"]}, '
+                           f'{rule["cooldown"]}s cooldown, '
+                           f'#{channel.name if channel else rule["channel"]})')
+                msg.append(f'\t{pattern}')
+        await ctx.sendmarkdown('\n'.join(msg))
+
+    @logalert.command(aliases=['edit', 'modify'])
+    async def add(self, ctx, server: str, name: str, severity: str, cooldown: int, *,
+                  pattern: str):
+        """Add an alert rule for a server's log.
+
+        Takes a servername, a name for the rule, a severity, which
+        is one of info, warning or critical, a cooldown in seconds,
+        during which further matches only get counted, and a pattern.
+        The pattern is matched literally, unless it is enclosed in
+        slashes, in which case it is a regular expression.
+        Alerts are posted to the channel this is run in.
+        """
+
+        if server not in self.servercfg['servers']:
+            log.warning(f'{server} has been misspelled or not configured!')
+            await ctx.sendmarkdown(f'< {server} has been misspelled or not configured! >')
+            return
+        if severity not in severities:
+            await ctx.sendmarkdown(f'< Severity must be one of: {", ".join(severities)}! >')
+            return
+        regex = len(pattern) > 1 and pattern.startswith('/') and pattern.endswith('/')
+        if regex:
+            pattern = pattern[1:-1]
+        rules = dict(self.alertcfg['rules'].get(server, {}))
+        rules[name] = {
+            'pattern': pattern, 'regex': regex, 'severity': severity,
+            'cooldown': max(0, cooldown), 'channel': ctx.channel.id
+        }
+        try:
+            AlertMatcher(rules)
+        except re.error as e:
+            await ctx.sendmarkdown(f'< Invalid regular expression: {e} >')
+            return
+        self.alertcfg['rules'][server] = rules
+        self.lastfired.pop((server, name), None)
+        self.suppressed.pop((server, name), None)
+        await self.alertcfg.save()
+        self._rewatch(server)
+        log.info(f'Added alert rule \"{name}\" for {server}.')
+        await ctx.sendmarkdown(f'# Added alert rule \"{name}\" for {server}!')
+
+    @logalert.command(aliases=['delete'])
+    async def remove(self, ctx, server: str, name: str):
+        """Remove an alert rule from a server."""
+
+        rules = self.alertcfg['rules'].get(server, {})
+        if name not in rules:
+            await ctx.sendmarkdown(f'< No alert rule \"{name}\" for {server}! >')
+            return
+        del rules[name]
+        if not rules:
+            del self.alertcfg['rules'][server]
+        await self.alertcfg.save()
+        self._rewatch(server)
+        log.info(f'Removed alert rule \"{name}\" from {server}.')
+        await ctx.sendmarkdown(f'# Removed alert rule \"{name}\" from {server}!')
+
+
+def setup(bot):
+    if not hasattr(bot, 'servercfg'):
+        default = {
+            "servers": {}, "serverspath": "NONE", "backupspath": "NONE", "oldTimer": 1440
+        }
+        bot.servercfg = Config(f'{bot.dir}/configs/serverCfgs.toml',
+                               default=default,
+                               load=True, loop=bot.loop)
+    bot.register_nodes([f'{__name__}.alerts'])
+    bot.add_cog(LogAlerts(bot))
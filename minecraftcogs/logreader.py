@@ -1,20 +1,44 @@
 import logging
 import os
+import re
 import asyncio
-from time import sleep, time
-from threading import Event
+import multiprocessing
+from time import time
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
 from discord.ext import commands
 from utils import Config, permission_node
+from .utils import subscribeLog, logfiles, searchfile, getLogIndex, readwindow, clip, \
+    OutputBatcher
 
 log = logging.getLogger('charfred')
 
 
+def _parsewhen(when, end=False):
+    """Parses 'YYYY-MM-DD' or 'YYYY-MM-DDTHH:MM' into a datetime;
+    a bare date stands for the start of that day, or its end.
+    """
+
+    try:
+        return datetime.strptime(when, '%Y-%m-%dT%H:%M')
+    except ValueError:
+        day = datetime.strptime(when, '%Y-%m-%d')
+        return day.replace(hour=23, minute=59, second=59) if end else day
+
+
 class LogReader(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.loop = bot.loop
         self.servercfg = bot.servercfg
         self.logfutures = {}
+        self.searchpool = None
+
+    def cog_unload(self):
+        for fut, event in self.logfutures.values():
+            event.set()
+        if self.searchpool:
+            self.searchpool.shutdown(wait=False)
 
     @commands.group()
     @permission_node(f'{__name__}.read')
@@ -45,37 +69,35 @@ class LogReader(commands.Cog):
             await ctx.sendmarkdown(f'< Log file for {server} not found! >')
             return
 
-        def _watchlog(event):
+        async def _watchlog(event, sub):
             timestamp = time()
             if timeout and timeout < 1800:
                 stopwhen = timestamp + timeout
-                coro = ctx.sendmarkdown(f'# Reading log for {server} for {timeout} seconds...\n'
-                                        f'< Please run \'log endwatch {server}\' if you\'re\n'
-                                        'not actively following the log! >')
+                await ctx.sendmarkdown(f'# Reading log for {server} for {timeout} seconds...\n'
+                                       f'< Please run \'log endwatch {server}\' if you\'re\n'
+                                       'not actively following the log! >')
             else:
                 stopwhen = timestamp + 1800
-                coro = ctx.sendmarkdown(f'# Reading log for {server} for 1800 seconds...\n'
-                                        f'< Please run \'log endwatch {server}\' if you\'re\n'
-                                        'not actively following the log! >')
-            asyncio.run_coroutine_threadsafe(coro, self.loop)
-            with open(self.servercfg['serverspath'] + f'/{server}/logs/latest.log', 'r') as mclog:
-                log.info(f'LW: Reading log for {server} for {timeout} seconds...')
-                mclog.seek(0, 2)
-                outlines = []
-                while not event.is_set() and time() < stopwhen:
-                    line = mclog.readline()
+                await ctx.sendmarkdown(f'# Reading log for {server} for 1800 seconds...\n'
+                                       f'< Please run \'log endwatch {server}\' if you\'re\n'
+                                       'not actively following the log! >')
+            log.info(f'LW: Reading log for {server} for {timeout} seconds...')
+            batcher = OutputBatcher(ctx.sendmarkdown, self.loop)
+            try:
+                while not event.is_set() and time() < stopwhen and not sub.closed:
+                    if batcher.task.done():
+                        break
+                    try:
+                        line = await asyncio.wait_for(sub.get(), 1, loop=self.loop)
+                    except asyncio.TimeoutError:
+                        line = None
+                    batcher.skip(sub.skipped)
+                    sub.skipped = 0
                     if line and line.startswith('['):
-                        outlines.append('# ' + line if len(line) < 225 else (line[:225] + ' [...]'))
-                        if len(outlines) == 8 or (time() - timestamp) > 5:
-                            out = '\n'.join(outlines)
-                            coro = ctx.sendmarkdown(out)
-                            asyncio.run_coroutine_threadsafe(coro, self.loop)
-                            outlines = []
-                            timestamp = time()
-                            sleep(1)
-                    else:
-                        sleep(0.2)
-                return
+                        batcher.put('# ' + line if len(line) < 225 else (line[:225] + ' [...]'))
+            finally:
+                sub.close()
+                await batcher.close()
 
         def _watchDone(future):
             log.info(f'LW: Done reading log for {server}!')
@@ -86,10 +108,11 @@ class LogReader(commands.Cog):
                                         'to terminate immaturely! >')
             else:
                 coro = ctx.sendmarkdown(f'> Stopped reading log for {server}.')
-            asyncio.run_coroutine_threadsafe(coro, self.loop)
+            self.loop.create_task(coro)
 
-        event = Event()
-        logfuture = self.loop.run_in_executor(None, _watchlog, event)
+        event = asyncio.Event(loop=self.loop)
+        sub = subscribeLog(self.servercfg['serverspath'] + f'/{server}/logs/latest.log', self.loop)
+        logfuture = self.loop.create_task(_watchlog(event, sub))
         logfuture.add_done_callback(_watchDone)
         self.logfutures[server] = (logfuture, event)
 
@@ -108,6 +131,145 @@ class LogReader(commands.Cog):
             else:
                 await ctx.sendmarkdown(f'# No currently active reader for {server}\'s log found.')
 
+    @log.command(aliases=['grep'])
+    async def search(self, ctx, server: str, pattern: str, *options: str):
+        """Searches a server's current and archived logs.
+
+        Takes a servername and a regular expression, put the
+        expression in quotes if it contains spaces.
+        Optionally takes '--since' and '--until', each followed by
+        either YYYY-MM-DD or YYYY-MM-DDTHH:MM, to narrow down the
+        searched time range, and '--limit N' for the
+        maximum number of matches returned, 50 by default.
+        Matches are sent as they are found, per log file.
+        """
+
+        if server not in self.servercfg['servers']:
+            log.warning(f'{server} has been misspelled or not configured!')
+            await ctx.sendmarkdown(f'< {server} has been misspelled or not configured! >')
+            return
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            await ctx.sendmarkdown(f'< Invalid regular expression: {e} >')
+            return
+        since = until = None
+        limit = 50
+        opts = iter(options)
+        try:
+            for opt in opts:
+                if opt == '--since':
+                    since = _parsewhen(next(opts))
+                elif opt == '--until':
+                    until = _parsewhen(next(opts), end=True)
+                elif opt == '--limit':
+                    limit = max(1, int(next(opts)))
+                else:
+                    raise ValueError(opt)
+        except (StopIteration, ValueError):
+            await ctx.sendmarkdown('< Invalid options! >\n'
+                                   '> Valid are: --since YYYY-MM-DD[THH:MM], '
+                                   '--until YYYY-MM-DD[THH:MM], --limit N')
+            return
+
+        logspath = self.servercfg['serverspath'] + f'/{server}/logs'
+        files = await self.loop.run_in_executor(
+            None, logfiles, logspath, since and since.date(), until and until.date()
+        )
+        if not files:
+            await ctx.sendmarkdown(f'< No logs for {server} found! >')
+            return
+        if since or until:
+            index = getLogIndex(logspath)
+            await self.loop.run_in_executor(None, index.update)
+            windows = [index.window(path, since, until) for path in files]
+        else:
+            windows = [(0, None)] * len(files)
+        log.info(f'LS: Searching {len(files)} logs of {server} for \"{pattern}\".')
+        await ctx.sendmarkdown(f'# Searching {len(files)} logs of {server}...')
+        if self.searchpool is None:
+            # Forking the bot, with all its threads and sockets,
+            # may deadlock the workers, so they are forked off a clean server.
+            self.searchpool = ProcessPoolExecutor(
+                mp_context=multiprocessing.get_context('forkserver')
+            )
+        futures = [self.loop.run_in_executor(self.searchpool, searchfile,
+                                             path, pattern, limit, start, end)
+                   for path, (start, end) in zip(files, windows)]
+        found = 0
+        try:
+            for fut in asyncio.as_completed(futures, loop=self.loop):
+                path, matches = await fut
+                if not matches:
+                    continue
+                matches = matches[:limit - found]
+                found += len(matches)
+                chunk = f'> {os.path.basename(path)}:'
+                for line in matches:
+                    line = '# ' + line if len(line) < 225 else ('# ' + line[:225] + ' [...]')
+                    if len(chunk) + len(line) > 1900:
+                        await ctx.sendmarkdown(chunk)
+                        chunk = ''
+                    chunk += '\n' + line
+                await ctx.sendmarkdown(chunk)
+                if found >= limit:
+                    break
+        finally:
+            for fut in futures:
+                fut.cancel()
+        if found >= limit:
+            await ctx.sendmarkdown(f'> Stopped after {limit} matches.')
+        elif found:
+            await ctx.sendmarkdown(f'> Found {found} matches.')
+        else:
+            await ctx.sendmarkdown('< No matches found! >')
+
+    @log.command()
+    async def at(self, ctx, server: str, day: str, clock: str, minutes: int=5):
+        """Shows what a server logged at a given time.
+
+        Takes a servername, a date as YYYY-MM-DD, a time as HH:MM
+        and optionally the number of minutes to show, 5 by default,
+        at most 120.
+        """
+
+        if server not in self.servercfg['servers']:
+            log.warning(f'{server} has been misspelled or not configured!')
+            await ctx.sendmarkdown(f'< {server} has been misspelled or not configured! >')
+            return
+        try:
+            since = _parsewhen(f'{day}T{clock}')
+        except ValueError:
+            await ctx.sendmarkdown('< Invalid time, expected YYYY-MM-DD HH:MM! >')
+            return
+        until = since + timedelta(minutes=max(1, min(minutes, 120)), seconds=-1)
+
+        logspath = self.servercfg['serverspath'] + f'/{server}/logs'
+        index = getLogIndex(logspath)
+        await self.loop.run_in_executor(None, index.update)
+        files = await self.loop.run_in_executor(
+            None, logfiles, logspath, since.date(), until.date()
+        )
+        lines = []
+        for path in files:
+            start, end = index.window(path, since, until)
+            window = await self.loop.run_in_executor(None, readwindow, path, start, end)
+            lines.extend(clip(window, since, until))
+        if not lines:
+            await ctx.sendmarkdown(f'< Nothing logged by {server} at that time! >')
+            return
+        if len(lines) > 60:
+            await ctx.sendmarkdown(f'> Showing the first 60 of {len(lines)} lines.')
+            lines = lines[:60]
+        chunk = ''
+        for line in lines:
+            line = '# ' + line if len(line) < 225 else ('# ' + line[:225] + ' [...]')
+            if len(chunk) + len(line) > 1900:
+                await ctx.sendmarkdown(chunk)
+                chunk = ''
+            chunk += '\n' + line
+        await ctx.sendmarkdown(chunk)
+
 
 def setup(bot):
     if not hasattr(bot, 'servercfg'):
@@ -0,0 +1,131 @@
+from discord.ext import commands
+import asyncio
+import logging
+from time import strftime, localtime
+from utils import Config, permission_node
+from .utils import isUp, getPlaytimeStore
+
+log = logging.getLogger('charfred')
+
+
+def _duration(secs):
+    hours, secs = divmod(int(secs), 3600)
+    return f'{hours}h {secs // 60:02d}m'
+
+
+class Playtime(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.loop = bot.loop
+        self.servercfg = bot.servercfg
+
+    def _store(self, server):
+        return getPlaytimeStore(self.servercfg['serverspath'] + f'/{server}/logs')
+
+    def _updateOne(self, server, store):
+        store.update(isUp(server, self.servercfg['serverspath']))
+
+    async def _update(self, servers):
+        """Brings the playtime stores of the given servers up to date,
+        which only processes what was logged since the last update.
+        """
+
+        stores = [self._store(server) for server in servers]
+        await asyncio.gather(*[self.loop.run_in_executor(None, self._updateOne, server, store)
+                               for server, store in zip(servers, stores)], loop=self.loop)
+        return stores
+
+    @commands.group(invoke_without_command=True)
+    @permission_node(f'{__name__}.playtime')
+    async def playtime(self, ctx, player: str=None):
+        """Player playtime commands.
+
+        This returns a player's playtime on every server,
+        if no subcommand was given.
+        """
+
+        if player is None:
+            await ctx.sendmarkdown('< Please give me a player to look up! >')
+            return
+        servers = list(self.servercfg['servers'])
+        stores = await self._update(servers)
+        title = f'Playtime of {player}'
+        msg = [title, '=' * len(title)]
+        total = 0
+        for server, store in zip(servers, stores):
+            seen = store.lastseen(player)
+            if seen is None:
+                continue
+            alltime = store.playtime(player)
+            total += alltime
+            if player in store.online():
+                status = 'online now'
+            else:
+                status = f'last seen {strftime("%Y-%m-%d %H:%M", localtime(seen))}'
+            msg.append(f'# {server}: {_duration(alltime)} total, '
+                       f'{_duration(store.playtime(player, 7))} this week, {status}')
+        if len(msg) == 2:
+            await ctx.sendmarkdown(f'< {player} has not played on any server! >')
+            return
+        msg.append(f'> {_duration(total)} in total.')
+        await ctx.sendmarkdown('\n'.join(msg))
+
+    @playtime.command()
+    async def top(self, ctx, server: str, days: int=30):
+        """Lists the players with the most playtime on a server.
+
+        Takes a servername and optionally a number of days
+        to look back on, 30 by default.
+        """
+
+        if server not in self.servercfg['servers']:
+            log.warning(f'{server} has been misspelled or not configured!')
+            await ctx.sendmarkdown(f'< {server} has been misspelled or not configured! >')
+            return
+        store, = await self._update([server])
+        top = store.top(max(1, days))
+        if not top:
+            await ctx.sendmarkdown(f'< Nobody played on {server} in the last {days} days! >')
+            return
+        title = f'Top players on {server}, last {days} days'
+        msg = [title, '=' * len(title)]
+        for i, (player, secs) in enumerate(top, 1):
+            msg.append(f'{i:2d}. {player:<16} {_duration(secs)}')
+        await ctx.sendmarkdown('\n'.join(msg))
+
+    @playtime.command(aliases=['histogram'])
+    async def hours(self, ctx, server: str, days: int=30):
+        """Shows the average number of concurrent players on a server
+        for each hour of the day.
+
+        Takes a servername and optionally a number of days
+        to look back on, 30 by default.
+        """
+
+        if server not in self.servercfg['servers']:
+            log.warning(f'{server} has been misspelled or not configured!')
+            await ctx.sendmarkdown(f'< {server} has been misspelled or not configured! >')
+            return
+        store, = await self._update([server])
+        hours = store.hours(max(1, days))
+        peak = max(hours)
+        if not peak:
+            await ctx.sendmarkdown(f'< Nobody played on {server} in the last {days} days! >')
+            return
+        title = f'Concurrent players on {server}, last {days} days'
+        msg = [title, '=' * len(title)]
+        for hour, avg in enumerate(hours):
+            msg.append(f'{hour:02d}:00 {"#" * round(30 * avg / peak):<30} {avg:.1f}')
+        await ctx.sendmarkdown('\n'.join(msg))
+
+
+def setup(bot):
+    if not hasattr(bot, 'servercfg'):
+        default = {
+            "servers": {}, "serverspath": "NONE", "backupspath": "NONE", "oldTimer": 1440
+        }
+        bot.servercfg = Config(f'{bot.dir}/configs/serverCfgs.toml',
+                               default=default,
+                               load=True, loop=bot.loop)
+    bot.register_nodes([f'{__name__}.playtime'])
+    bot.add_cog(Playtime(bot))
@@ -82,7 +82,7 @@ class ServerBackups(commands.Cog):
             return
         if r:
             log.info('Confirmed!')
-            if isUp(server):
+            if isUp(server, self.servercfg['serverspath']):
                 log.warning(f'{server} still up, cannot proceed!')
                 await ctx.sendmarkdown(f'{server} is still up, cannot proceed!')
                 return
@@ -143,7 +143,7 @@ class ServerBackups(commands.Cog):
             return
         if r:
             log.info('Confirmed!')
-            if isUp(server):
+            if isUp(server, self.servercfg['serverspath']):
                 log.warning(f'{server} still up, cannot proceed!')
                 await ctx.sendmarkdown(f'{server} is still up, cannot proceed!')
                 return
@@ -2,8 +2,9 @@ from discord.ext import commands
 import asyncio
 import logging
 from utils import Config, permission_node
-from .utils import isUp, sendCmd, sendCmds, serverStart, \
-    serverStop, serverTerminate, serverStatus, buildCountdownSteps
+from .utils import isUp, getProc, sendCmd, sendCmds, fanout, serverStart, \
+    serverStop, waitForStop, serverTerminate, serverStatus, buildCountdownSteps, ResourceSampler, \
+    closeRconPools
 
 log = logging.getLogger('charfred')
 
@@ -13,6 +14,24 @@ class ServerCmds(commands.Cog):
         self.bot = bot
         self.loop = bot.loop
         self.servercfg = bot.servercfg
+        if 'starttimeout' not in self.servercfg:
+            self.servercfg['starttimeout'] = 300
+        if 'stoptimeout' not in self.servercfg:
+            self.servercfg['stoptimeout'] = 60
+        if 'sampleinterval' not in self.servercfg:
+            self.servercfg['sampleinterval'] = 10
+        if 'startstagger' not in self.servercfg:
+            self.servercfg['startstagger'] = 5
+        if 'rollingmaxdown' not in self.servercfg:
+            self.servercfg['rollingmaxdown'] = 2
+        self.rolling = False
+        self.sampler = ResourceSampler(self.servercfg, self.loop,
+                                       interval=int(self.servercfg['sampleinterval']))
+        self.sampler.start()
+
+    def cog_unload(self):
+        self.sampler.stop()
+        closeRconPools()
 
     @commands.group(invoke_without_command=True)
     @permission_node(f'{__name__}.status')
@@ -30,21 +49,73 @@ class ServerCmds(commands.Cog):
             log.warning(f'{server} has been misspelled or not configured!')
             await ctx.sendmarkdown(f'< {server} has been misspelled or not configured! >')
             return
-        if isUp(server):
+        if isUp(server, self.servercfg['serverspath']):
             log.info(f'{server} appears to be running already!')
             await ctx.sendmarkdown(f'< {server} appears to be running already! >')
         else:
             log.info(f'Starting {server}')
             await ctx.sendmarkdown(f'> Starting {server}...')
-            await serverStart(server, self.servercfg, self.loop)
-            await asyncio.sleep(5, loop=self.loop)
-            if isUp(server):
+            timeout = int(self.servercfg['starttimeout'])
+            took = await serverStart(server, self.servercfg, self.loop, timeout=timeout)
+            if took is not None:
                 log.info(f'{server} is now running!')
-                await ctx.sendmarkdown(f'# {server} is now running!')
+                await ctx.sendmarkdown(f'# {server} is now running! (Started in {took:.1f} seconds)')
+            elif isUp(server, self.servercfg['serverspath']):
+                log.warning(f'{server} is running, but has not finished loading!')
+                await ctx.sendmarkdown(f'< {server} is running, but has not finished '
+                                       f'loading within {timeout} seconds! >')
             else:
                 log.warning(f'{server} does not appear to have started!')
                 await ctx.sendmarkdown(f'< {server} does not appear to have started! >')
 
+    @server.command(aliases=['startcategory'])
+    @permission_node(f'{__name__}.start')
+    async def startall(self, ctx, category: str=None):
+        """Start many servers in parallel.
+
+        Takes an optional whitelist category name, to only
+        start servers in that category, otherwise all known
+        servers that are not running are started.
+        Spawns are staggered by the 'startstagger' server
+        configuration, in seconds, to spread out the load.
+        """
+
+        if category is None or category.lower() == 'all':
+            servers = list(self.servercfg['servers'])
+        elif category in self.servercfg.get('whitelistcategories', {}):
+            servers = list(self.servercfg['whitelistcategories'][category])
+        else:
+            log.warning('Category not found!')
+            await ctx.sendmarkdown(f'< {category} does not exist! >')
+            return
+        down = await self.loop.run_in_executor(
+            None, lambda: [s for s in servers if not isUp(s, self.servercfg['serverspath'])]
+        )
+        if not down:
+            await ctx.sendmarkdown('> All of these servers are running already!')
+            return
+        stagger = float(self.servercfg['startstagger'])
+        timeout = int(self.servercfg['starttimeout'])
+        log.info(f'Starting {", ".join(down)}.')
+        await ctx.sendmarkdown(f'> Starting {len(down)} servers, {stagger} seconds apart...')
+
+        async def launch(i, server):
+            await asyncio.sleep(i * stagger, loop=self.loop)
+            log.info(f'Starting {server}')
+            took = await serverStart(server, self.servercfg, self.loop, timeout=timeout)
+            if took is not None:
+                return f'# {server} is now running! (Started in {took:.1f} seconds)'
+            elif isUp(server, self.servercfg['serverspath']):
+                return f'< {server} is running, but has not finished loading! >'
+            else:
+                log.warning(f'{server} does not appear to have started!')
+                return f'< {server} does not appear to have started! >'
+
+        msg = ['Command Log', '==========']
+        msg.extend(await asyncio.gather(*[launch(i, s) for i, s in enumerate(down)],
+                                        loop=self.loop))
+        await ctx.sendmarkdown('\n'.join(msg))
+
     @server.command()
     @permission_node(f'{__name__}.stop')
     async def stop(self, ctx, server: str):
@@ -58,12 +129,12 @@ class ServerCmds(commands.Cog):
             log.warning(f'{server} has been misspelled or not configured!')
             await ctx.sendmarkdown(f'< {server} has been misspelled or not configured! >')
             return
-        if isUp(server):
+        if isUp(server, self.servercfg['serverspath']):
             log.info(f'Stopping {server}...')
             await ctx.sendmarkdown(f'> Stopping {server}...')
-            await serverStop(server, self.loop)
-            await asyncio.sleep(20, loop=self.loop)
-            if isUp(server):
+            took = await serverStop(server, self.loop, self.servercfg,
+                                    timeout=int(self.servercfg['stoptimeout']))
+            if took is None and isUp(server, self.servercfg['serverspath']):
                 log.warning(f'{server} does not appear to have stopped!')
                 msg = await ctx.sendmarkdown(f'< {server} does not appear to have stopped! >'
                                              f'React with ❌ within 60 seconds to force stop {server}!',
@@ -89,7 +160,7 @@ class ServerCmds(commands.Cog):
                     await msg.clear_reactions()
                     await msg.edit(content='```markdown\n> Attempting termination!\n'
                                    '> Please hold, this may take a couple of seconds.```')
-                    killed = await serverTerminate(server, self.loop)
+                    killed = await serverTerminate(server, self.loop, self.servercfg['serverspath'])
                     if killed:
                         log.info(f'{server} terminated.')
                         await msg.edit(content=f'```markdown\n# {server} terminated.\n'
@@ -99,7 +170,10 @@ class ServerCmds(commands.Cog):
                         await msg.edit(content=f'```markdown\n< {server} termination failed! >\n')
             else:
                 log.info(f'{server} was stopped.')
-                await ctx.sendmarkdown(f'# {server} was stopped.')
+                if took is None:
+                    await ctx.sendmarkdown(f'# {server} was stopped.')
+                else:
+                    await ctx.sendmarkdown(f'# {server} was stopped. (Took {took:.1f} seconds)')
         else:
             log.info(f'{server} already is not running.')
             await ctx.sendmarkdown(f'< {server} already is not running. >')
@@ -123,7 +197,7 @@ class ServerCmds(commands.Cog):
             log.warning(f'{server} has been misspelled or not configured!')
             await ctx.sendmarkdown(f'< {server} has been misspelled or not configured! >')
             return
-        if isUp(server):
+        if isUp(server, self.servercfg['serverspath']):
             countdownSteps = ["20m", "15m", "10m", "5m", "3m",
                               "2m", "1m", "30s", "10s", "5s"]
             if countdown:
@@ -153,7 +227,8 @@ class ServerCmds(commands.Cog):
                     'title @a times 20 40 20',
                     f'title @a subtitle {{\"text\":\"in {step[0]} {step[2]}!\",\"italic\":true}}',
                     'title @a title {\"text\":\"Restarting\", \"bold\":true}',
-                    f'broadcast Restarting in {step[0]} {step[2]}!'
+                    f'broadcast Restarting in {step[0]} {step[2]}!',
+                    servercfg=self.servercfg
                 )
                 msg = f'```markdown\nRestarting {server} in {step[0]} {step[2]}!\nReact with ✋ to abort!\n```'
                 await announcement.edit(content=msg)
@@ -174,24 +249,32 @@ class ServerCmds(commands.Cog):
                         server,
                         'title @a times 20 40 20',
                         'title @a title {\"text\":\"Restart aborted!\", \"bold\":true}',
-                        'broadcast Restart aborted!'
+                        'broadcast Restart aborted!',
+                        servercfg=self.servercfg
                     )
                     await ctx.sendmarkdown(f'# Restart of {server} aborted!')
                     return
+            proc = await self.loop.run_in_executor(
+                None, getProc, server, self.servercfg['serverspath']
+            )
+            started = self.loop.time()
             await sendCmd(
                 self.loop,
                 server,
-                'save-all'
+                'save-all',
+                servercfg=self.servercfg
             )
             await asyncio.sleep(5, loop=self.loop)
             await sendCmd(
                 self.loop,
                 server,
-                'stop'
+                'stop',
+                servercfg=self.servercfg
             )
             await announcement.edit(content=f'```markdown\n> Stopping {server}\n```.')
-            await asyncio.sleep(30, loop=self.loop)
-            if isUp(server):  # TODO: Fix all this terminating stuff
+            stopped = await waitForStop(server, self.loop, int(self.servercfg['stoptimeout']),
+                                        self.servercfg['serverspath'], proc)
+            if not stopped:  # TODO: Fix all this terminating stuff
                 log.warning(f'Restart failed, {server} appears not to have stopped!')
 
                 def termcheck(reaction, user):
@@ -218,7 +301,7 @@ class ServerCmds(commands.Cog):
                     await announcement.clear_reactions()
                     await announcement.edit(content='```markdown\n> Attempting termination!\n'
                                             '> Please hold, this may take a couple of seconds.```')
-                    killed = await serverTerminate(server, self.loop)
+                    killed = await serverTerminate(server, self.loop, self.servercfg['serverspath'])
                     if killed:
                         log.info(f'{server} terminated.')
                         await announcement.edit(content=f'```markdown\n# {server} terminated.\n'
@@ -228,15 +311,22 @@ class ServerCmds(commands.Cog):
                         log.info(f'{server} termination failed!')
                         await announcement.edit(content=f'```markdown\n< {server} termination failed! >\n')
             else:
+                took = self.loop.time() - started
                 log.info(f'Restart in progress, {server} was stopped.')
-                await ctx.sendmarkdown(f'# Restart in progress, {server} was stopped.')
+                await ctx.sendmarkdown(f'# Restart in progress, {server} was stopped. '
+                                       f'(Took {took:.1f} seconds)')
                 log.info(f'Starting {server}')
                 await ctx.sendmarkdown(f'> Starting {server}.')
-                await serverStart(server, self.servercfg, self.loop)
-                await asyncio.sleep(5, loop=self.loop)
-                if isUp(server):
+                timeout = int(self.servercfg['starttimeout'])
+                took = await serverStart(server, self.servercfg, self.loop, timeout=timeout)
+                if took is not None:
                     log.info(f'Restart successful, {server} is now running!')
-                    await ctx.sendmarkdown(f'# Restart successful, {server} is now running!')
+                    await ctx.sendmarkdown(f'# Restart successful, {server} is now running! '
+                                           f'(Started in {took:.1f} seconds)')
+                elif isUp(server, self.servercfg['serverspath']):
+                    log.warning(f'Restart incomplete, {server} has not finished loading!')
+                    await ctx.sendmarkdown(f'< Restart incomplete, {server} is running, but has not '
+                                           f'finished loading within {timeout} seconds! >')
                 else:
                     log.warning(f'Restart failed, {server} does not appear to have started!')
                     await ctx.sendmarkdown(f'< Restart failed, {server} does not appear to have started! >')
@@ -244,6 +334,167 @@ class ServerCmds(commands.Cog):
             log.warning(f'Restart cancelled, {server} is offline!')
             await ctx.sendmarkdown(f'< Restart cancelled, {server} is offline! >')
 
+    async def _restartOne(self, server, status):
+        """Stops a server and starts it back up again,
+        for use by the rolling restart.
+        """
+        status[server] = 'stopping'
+        took = await serverStop(server, self.loop, self.servercfg,
+                                timeout=int(self.servercfg['stoptimeout']))
+        if took is None and isUp(server, self.servercfg['serverspath']):
+            log.warning(f'Rolling restart: {server} did not stop!')
+            status[server] = 'failed to stop!'
+            return
+        status[server] = 'starting'
+        took = await serverStart(server, self.servercfg, self.loop,
+                                 timeout=int(self.servercfg['starttimeout']))
+        if took is not None:
+            status[server] = f'running again, started in {took:.1f} seconds'
+        elif isUp(server, self.servercfg['serverspath']):
+            status[server] = 'running, but did not finish loading!'
+        else:
+            log.warning(f'Rolling restart: {server} did not start!')
+            status[server] = 'failed to start!'
+
+    @server.command()
+    @permission_node(f'{__name__}.restart')
+    async def rollingrestart(self, ctx, category: str, countdown: str='10m', maxdown: int=None):
+        """Restart many servers with a shared countdown.
+
+        Takes a whitelist category name or 'all', and
+        optionally the starting point for the countdown,
+        as well as the maximum number of servers that may
+        be down at the same time, which defaults to the
+        'rollingmaxdown' server configuration.
+
+        The countdown runs on all servers at once, then
+        servers are restarted in batches, each batch being
+        fully started before the next one goes down.
+        The issuer may abort during the countdown.
+        """
+
+        if self.rolling:
+            await ctx.sendmarkdown('< A rolling restart is already in progress! >')
+            return
+        if category.lower() == 'all':
+            servers = list(self.servercfg['servers'])
+        elif category in self.servercfg.get('whitelistcategories', {}):
+            servers = list(self.servercfg['whitelistcategories'][category])
+        else:
+            log.warning('Category not found!')
+            await ctx.sendmarkdown(f'< {category} does not exist! >')
+            return
+        countdownSteps = ["20m", "15m", "10m", "5m", "3m",
+                          "2m", "1m", "30s", "10s", "5s"]
+        if countdown not in countdownSteps:
+            log.error(f'{countdown} is an undefined step, aborting!')
+            await ctx.sendmarkdown(f'< {countdown} is an undefined step, aborting! >\n'
+                                   '> Available countdown steps are:\n'
+                                   f'> {", ".join(countdownSteps)}')
+            return
+        maxdown = max(1, maxdown or int(self.servercfg['rollingmaxdown']))
+        up = await self.loop.run_in_executor(
+            None, lambda: [s for s in servers if isUp(s, self.servercfg['serverspath'])]
+        )
+        if not up:
+            await ctx.sendmarkdown('< None of these servers are running! >')
+            return
+
+        status = {s: 'counting down' for s in up}
+        header = [f'Rolling restart of {len(up)} servers, at most {maxdown} down at a time']
+        header.append('=' * len(header[0]))
+
+        def render():
+            lines = '\n'.join(header + [f'{s}: {st}' for s, st in status.items()])
+            return '```markdown\n' + lines[:1980] + '\n```'
+
+        done = self.loop.create_future()
+        announcement = updates = None
+
+        async def updater():
+            shown = None
+            while True:
+                content = render()
+                if content != shown:
+                    await announcement.edit(content=content)
+                    shown = content
+                if done.done():
+                    return
+                await asyncio.wait([done], timeout=3, loop=self.loop)
+
+        def check(reaction, user):
+            if reaction.message.id != announcement.id:
+                return False
+            return str(reaction.emoji) == '✋' and user == ctx.author
+
+        self.rolling = True
+        try:
+            announcement = await ctx.sendmarkdown('> Preparing rolling restart...', deletable=False)
+            await announcement.add_reaction('✋')
+            updates = self.loop.create_task(updater())
+            log.info(f'Rolling restart of {", ".join(up)} with {countdown}-countdown.')
+            steps = buildCountdownSteps(countdownSteps[countdownSteps.index(countdown):])
+            for step in steps:
+                header[1:] = ['=' * len(header[0]), f'> Restarting in {step[0]} {step[2]}!',
+                              '> React with ✋ to abort!']
+
+                async def announce(server):
+                    await sendCmds(
+                        self.loop,
+                        server,
+                        'title @a times 20 40 20',
+                        f'title @a subtitle {{\"text\":\"in {step[0]} {step[2]}!\",\"italic\":true}}',
+                        'title @a title {\"text\":\"Restarting\", \"bold\":true}',
+                        f'broadcast Restarting in {step[0]} {step[2]}!',
+                        servercfg=self.servercfg
+                    )
+
+                await fanout(self.loop, up, announce)
+                try:
+                    await self.bot.wait_for('reaction_add', timeout=step[1], check=check)
+                except asyncio.TimeoutError:
+                    pass
+                else:
+                    async def abort(server):
+                        await sendCmds(
+                            self.loop,
+                            server,
+                            'title @a times 20 40 20',
+                            'title @a title {\"text\":\"Restart aborted!\", \"bold\":true}',
+                            'broadcast Restart aborted!',
+                            servercfg=self.servercfg
+                        )
+
+                    await fanout(self.loop, up, abort)
+                    header[2:] = ['< Rolling restart aborted! >']
+                    for s in status:
+                        status[s] = 'aborted'
+                    log.info('Rolling restart aborted!')
+                    return
+
+            header[2:] = []
+            for s in up:
+                status[s] = 'queued'
+            batches = [up[i:i + maxdown] for i in range(0, len(up), maxdown)]
+
+            async def queued(server):
+                await sendCmd(self.loop, server, 'broadcast Restart queued, please stand by!',
+                              servercfg=self.servercfg)
+
+            await fanout(self.loop, up[maxdown:], queued)
+            for n, batch in enumerate(batches, 1):
+                header[2:] = [f'> Batch {n} of {len(batches)}...']
+                await asyncio.gather(*[self._restartOne(s, status) for s in batch], loop=self.loop)
+            header[2:] = ['# Rolling restart complete!']
+            log.info('Rolling restart complete!')
+        finally:
+            self.rolling = False
+            done.set_result(None)
+            if updates is not None:
+                await updates
+            if announcement is not None:
+                await announcement.clear_reactions()
+
     @server.command()
     @permission_node(f'{__name__}.status')
     async def status(self, ctx, server: str=None):
@@ -260,9 +511,40 @@ class ServerCmds(commands.Cog):
             return
         else:
             servers = [server]
-        statuses = await serverStatus(servers, self.loop)
+        statuses = await serverStatus(servers, self.loop, self.servercfg['serverspath'])
         await ctx.sendmarkdown(f'{statuses}')
 
+    @server.command()
+    @permission_node(f'{__name__}.status')
+    async def stats(self, ctx, server: str):
+        """Shows resource usage of a server.
+
+        Lists current cpu, memory, thread and open file
+        counts, as well as their min, avg, max and 95th
+        percentile values over the last hour.
+        """
+        if server not in self.servercfg['servers']:
+            log.warning(f'{server} has been misspelled or not configured!')
+            await ctx.sendmarkdown(f'< {server} has been misspelled or not configured! >')
+            return
+        stats = self.sampler.stats(server)
+        if not stats:
+            await ctx.sendmarkdown(f'< No samples for {server} yet! >')
+            return
+
+        def fmt(metric, v):
+            if metric == 'cpu':
+                return f'{v:.1f}%'
+            if metric == 'rss':
+                return f'{v / 1048576:.0f}M'
+            return f'{v:.0f}'
+
+        msg = [f'# Resource usage of {server}:',
+               f'{"":<8}{"now":>9}{"min":>9}{"avg":>9}{"max":>9}{"p95":>9}']
+        for metric, values in stats.items():
+            msg.append(f'{metric:<8}' + ''.join(f'{fmt(metric, v):>9}' for v in values))
+        await ctx.sendmarkdown('\n'.join(msg))
+
     @server.command()
     @permission_node(f'{__name__}.terminate')
     async def terminate(self, ctx, server: str):
@@ -272,14 +554,14 @@ class ServerCmds(commands.Cog):
             log.warning(f'{server} has been misspelled or not configured!')
             await ctx.sendmarkdown(f'< {server} has been misspelled or not configured! >')
             return
-        if not isUp(server):
+        if not isUp(server, self.servercfg['serverspath']):
             log.info(f'{server} is not running!')
             await ctx.sendmarkdown(f'< {server} is not running! >')
             return
         log.info(f'Attempting termination of {server}...')
         await ctx.sendmarkdown(f'> Attempting termination of {server}\n'
                                '> Please hold, this may take a couple of seconds.')
-        killed = await serverTerminate(server, self.loop)
+        killed = await serverTerminate(server, self.loop, self.servercfg['serverspath'])
         if killed:
             log.info(f'{server} terminated.')
             await ctx.sendmarkdown(f'# {server} terminated.')
@@ -2,11 +2,12 @@ from discord.ext import commands
 from discord.utils import find
 import asyncio
 import logging
+import os
 import re
-from time import strftime, localtime, time
-from threading import Event
+from time import strftime, localtime, monotonic
 from utils import Config, permission_node
-from .utils import isUp, getProc, serverStart, getcrashreport, parsereport, formatreport
+from .utils import isUp, getProc, waitForExit, serverStart, getCrashIndex, parsereport, \
+    formatreport, recordCrash, describeCrash, getInotify, IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE, IN_IGNORED
 
 log = logging.getLogger('charfred')
 
@@ -14,22 +15,57 @@ cronpat = re.compile(r'^(?P<disabled>#)*((?P<reboot>@reboot)|(?P<min>(\*/\d+|\*|
 every = '*/'
 always = '*'
 
+UP = 'up'
+GONE = 'gone'
+CRASHED = 'crashed'
+RESTARTING = 'restarting'
+
+# A crash report only explains an exit this many seconds after it,
+# long enough for a hung server's shutdown to finish.
+crashwindow = 600
+
+
+class ServerWatch:
+    """State of a single watched server."""
+
+    def __init__(self, server, ctx):
+        self.server = server
+        self.ctx = ctx
+        self.state = GONE
+        self.proc = None
+        self.exited = None
+        self.nextcheck = 0
+        self.reports = set()
+        self.crashed = None
+        self.crashedat = 0
+        self.posting = None
+        self.wd = None
+        self.onreport = None
+        self.dirwd = None
+        self.ondir = None
+
 
 class Watchdog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.loop = bot.loop
         self.servercfg = bot.servercfg
+        self.crashsigs = bot.crashsigs
         self.watchdogs = {}
+        self.supervisor = None
+        self.wake = asyncio.Event(loop=self.loop)
         self.watchcfg = Config(f'{bot.dir}/configs/watchcfg.json',
                                load=True, loop=self.loop)
         if 'notify' not in self.watchcfg:
             self.watchcfg['notify'] = '@here'
 
     def cog_unload(self):
-        if self.watchdogs:
-            for fut, event in self.watchdogs.values():
-                event.set()
+        if self.supervisor:
+            self.supervisor.cancel()
+        for w in self.watchdogs.values():
+            if w.exited:
+                w.exited.cancel()
+            self._unwatchReports(w)
 
     @commands.group(invoke_without_command=True)
     @permission_node(f'{__name__}.watchdog')
@@ -40,11 +76,16 @@ class Watchdog(commands.Cog):
         if no subcommand was given.
         """
 
-        for server, wd in self.watchdogs.items():
-            if wd[0].done():
-                await ctx.sendmarkdown(f'< {server} watchdog inactive! >')
+        if not self.watchdogs:
+            await ctx.sendmarkdown('> No watchdogs active!')
+            return
+        msg = []
+        for server, w in self.watchdogs.items():
+            if w.state == UP:
+                msg.append(f'# {server} watchdog active, {server} is up!')
             else:
-                await ctx.sendmarkdown(f'# {server} watchdog active!')
+                msg.append(f'< {server} watchdog active, {server} is {w.state}! >')
+        await ctx.sendmarkdown('\n'.join(msg))
 
     @watchdog.command(aliases=['blame'])
     async def setmention(self, ctx, mentionee: str):
@@ -64,134 +105,306 @@ class Watchdog(commands.Cog):
             await ctx.sendmarkdown(f'< {mentionee} is not a valid role! >')
             log.warning('Role could not be found, role to mention unchanged.')
 
-    async def _wdstart(self, ctx, server):
-        if server in self.watchdogs and not self.watchdogs[server][0].done():
-            log.info(f'{server} watchdog active.')
-            await ctx.sendmarkdown('# Watchdog already active!')
+    async def serverGone(self, w, crashed, report=None):
+        if crashed:
+            await w.ctx.send(
+                f'{self.watchcfg["notify"]}\n'
+                '```markdown\n'
+                f'< {strftime("%H:%M", localtime())} : {w.server} crashed! >\n'
+                '```',
+                deletable=False
+            )
+            for c in report:
+                await asyncio.sleep(1, loop=self.loop)
+                await w.ctx.sendmarkdown(c)
         else:
-            if server not in self.servercfg['servers']:
-                log.warning(f'{server} has been misspelled or not configured!')
-                await ctx.sendmarkdown(f'< {server} has been misspelled or not configured! >')
-                return
+            await w.ctx.sendmarkdown(f'> {strftime("%H:%M", localtime())} : {w.server} is gone!\n'
+                                     '> Watching for it to return...', deletable=False)
+
+    async def serverBack(self, w):
+        await w.ctx.sendmarkdown('# ' + strftime("%H:%M") + f' {w.server} is back online!\n'
+                                 '> Continuing watch!', deletable=False)
+
+    async def startServer(self, w):
+        server = w.server
+        # TODO: Remove message informing about the change from 'react to restart' to 'react to abort'
+        abortPrompt = await w.ctx.sendmarkdown(
+            '< IMPORTANT NOTE: The purpose of this prompt has changed, please read it carefully! >\n\n'
+            f'# Attempting to start {server} back up again in 90 seconds!\n'
+            '< Please react to this message with ✋ to abort! >',
+            deletable=False
+        )
+        await abortPrompt.add_reaction('✋')
+
+        def abortcheck(reaction, user):
+            if reaction.message.id != abortPrompt.id:
+                return False
+            return str(reaction.emoji) == '✋' and not user.bot
 
-            if isUp(server):
-                log.info('Starting watchdog on online server.')
-                await ctx.sendmarkdown(f'# {server} is up and running.', deletable=False)
+        log.info(f'Prompting {server} start abort... 90 seconds.')
+        try:
+            await self.bot.wait_for('reaction_add', timeout=90, check=abortcheck)
+        except asyncio.TimeoutError:
+            log.info('Prompt timed out.')
+            await abortPrompt.clear_reactions()
+            await abortPrompt.edit(content='```markdown\n> Prompt to abort'
+                                   ' timed out!\n```')
+            await asyncio.sleep(5, loop=self.loop)
+            if isUp(server, self.servercfg['serverspath']):
+                log.info(f'{server} is already back!')
+                await abortPrompt.edit(content=f'```markdown\n> {server} is already back!\n```')
             else:
-                log.info('Starting watchdog on offline server.')
-                await ctx.sendmarkdown(f'< {server} is not running. >', deletable=False)
-
-            async def serverGone(crashed, report=None):
-                if crashed:
-                    await ctx.send(
-                        f'{self.watchcfg["notify"]}\n'
-                        '```markdown\n'
-                        f'< {strftime("%H:%M", localtime())} : {server} crashed! >\n'
-                        '```',
-                        deletable=False
-                    )
-                    for c in report:
-                        await asyncio.sleep(1, loop=self.loop)
-                        await ctx.sendmarkdown(c)
-                else:
-                    await ctx.sendmarkdown(f'> {strftime("%H:%M", localtime())} : {server} is gone!\n'
-                                           '> Watching for it to return...', deletable=False)
-
-            async def serverBack():
-                await ctx.sendmarkdown('# ' + strftime("%H:%M") + f' {server} is back online!\n'
-                                       '> Continuing watch!', deletable=False)
-
-            async def watchGone():
-                await ctx.sendmarkdown(f'> Ended watch on {server}!', deletable=False)
-
-            async def startServer():
-                # TODO: Remove message informing about the change from 'react to restart' to 'react to abort'
-                abortPrompt = await ctx.sendmarkdown(
-                    '< IMPORTANT NOTE: The purpose of this prompt has changed, please read it carefully! >\n\n'
-                    f'# Attempting to start {server} back up again in 90 seconds!\n'
-                    '< Please react to this message with ✋ to abort! >',
-                    deletable=False
-                )
-                await abortPrompt.add_reaction('✋')
-
-                def abortcheck(reaction, user):
-                    if reaction.message.id != abortPrompt.id:
-                        return False
-                    return str(reaction.emoji) == '✋' and not user.bot
-
-                log.info(f'Prompting {server} start abort... 90 seconds.')
-                try:
-                    await self.bot.wait_for('reaction_add', timeout=90, check=abortcheck)
-                except asyncio.TimeoutError:
-                    log.info('Prompt timed out.')
-                    await abortPrompt.clear_reactions()
-                    await abortPrompt.edit(content='```markdown\n> Prompt to abort'
-                                           ' timed out!\n```')
-                    await asyncio.sleep(5, loop=self.loop)
-                    if isUp(server):
-                        log.info(f'{server} is already back!')
-                        await abortPrompt.edit(content=f'```markdown\n> {server} is already back!\n```')
-                    else:
-                        log.info(f'Starting {server}')
-                        await abortPrompt.edit(content=f'```markdown\n> Starting {server}...\n```')
-                        await serverStart(server, self.servercfg, self.loop)
-                else:
-                    await abortPrompt.clear_reactions()
-                    await abortPrompt.edit(content=f'```markdown\n> Startup of {server} aborted!\n```')
-
-            def watchDone(future):
-                log.info(f'WD: Ending watch on {server}.')
-                if future.exception():
-                    log.warning(f'WD: Exception in watchdog for {server}!')
-                    raise future.exception()
-                asyncio.run_coroutine_threadsafe(watchGone(), self.loop)
-
-            def watch(event):
-                log.info(f'WD: Starting watch on {server}.')
-                serverProc = getProc(server)
-                if serverProc and serverProc.is_running():
-                    lastState = True
-                else:
-                    lastState = False
-                while not event.is_set():
-                    if lastState:
-                        if not serverProc.is_running():
-                            log.info(f'WD: {server} is gone!')
-                            lastState = False
-                            now = time()
-                            rpath, mtime = getcrashreport(server, self.servercfg['serverspath'])
-                            if mtime > (now - 60):
-                                crashed = True
-                                ctime, desc, strace, flav, lev, bl, ph = parsereport(rpath)
-                                report = formatreport(
-                                    rpath, ctime, desc, flav, strace, lev, bl, ph
-                                )
-                                coro = serverGone(crashed, report)
-                            else:
-                                crashed = False
-                                coro = serverGone(crashed)
-                            asyncio.run_coroutine_threadsafe(coro, self.loop)
-                            if crashed:
-                                asyncio.run_coroutine_threadsafe(startServer(), self.loop)
-                            event.wait(timeout=30)
-                        event.wait(timeout=20)
-                    else:
-                        serverProc = getProc(server)
-                        if serverProc and serverProc.is_running():
-                            log.info(f'WD: {server} is back online!')
-                            lastState = True
-                            asyncio.run_coroutine_threadsafe(serverBack(), self.loop)
-                            event.wait(timeout=20)
-                        else:
-                            event.wait(timeout=30)
+                log.info(f'Starting {server}')
+                await abortPrompt.edit(content=f'```markdown\n> Starting {server}...\n```')
+                w.state = RESTARTING
+                await serverStart(server, self.servercfg, self.loop)
+        else:
+            await abortPrompt.clear_reactions()
+            await abortPrompt.edit(content=f'```markdown\n> Startup of {server} aborted!\n```')
+
+    def _reportspath(self, server):
+        return self.servercfg['serverspath'] + f'/{server}/crash-reports'
+
+    def _reportNames(self, server):
+        """Returns the names of a server's crash reports, oldest first."""
+
+        reports = getCrashIndex(self._reportspath(server)).reports()
+        return [os.path.basename(rpath) for rpath, _ in reversed(reports)]
+
+    def _watchReports(self, w):
+        """Watches a server's crash-reports directory for new reports,
+        which are posted the moment they have been written.
+
+        If the server has never crashed, there is no directory to watch
+        yet, so the server's directory is watched for its creation.
+        """
+
+        inotify = getInotify(self.loop)
+        if inotify is None or w.wd is not None:
+            return
+        w.onreport = lambda mask, name: self._reportEvent(w, mask, name)
+        try:
+            w.wd = inotify.add_watch(self._reportspath(w.server),
+                                     IN_CLOSE_WRITE | IN_MOVED_TO, w.onreport)
+        except OSError as e:
+            w.onreport = None
+            if w.dirwd is not None:
+                return
+            w.ondir = lambda mask, name: self._reportsCreated(w, name)
+            try:
+                w.dirwd = inotify.add_watch(self.servercfg['serverspath'] + f'/{w.server}',
+                                            IN_CREATE | IN_MOVED_TO, w.ondir)
+            except OSError:
+                # New reports are then found when the server exits.
+                log.info(f'WD: Not watching crash reports of {w.server}: {e}')
+                w.ondir = None
+            return
+        if w.dirwd is not None:
+            inotify.rm_watch(w.dirwd, w.ondir)
+            w.dirwd = None
+
+    def _reportEvent(self, w, mask, name):
+        if mask & IN_IGNORED:
+            # The directory is gone, it is watched again once back.
+            w.wd = None
+            return
+        self._claimReport(w, name)
+
+    def _reportsCreated(self, w, name):
+        if name != 'crash-reports' or self.watchdogs.get(w.server) is not w:
+            return
+        self._watchReports(w)
+        if w.wd is not None:
+            # Reports written before the watch was added are new all the same.
+            self.loop.create_task(self._claimReports(w))
+
+    async def _claimReports(self, w):
+        names = await self.loop.run_in_executor(None, self._reportNames, w.server)
+        for name in names:
+            self._claimReport(w, name)
+
+    def _unwatchReports(self, w):
+        if w.wd is not None:
+            getInotify(self.loop).rm_watch(w.wd, w.onreport)
+            w.wd = None
+        if w.dirwd is not None:
+            getInotify(self.loop).rm_watch(w.dirwd, w.ondir)
+            w.dirwd = None
+
+    def _claimReport(self, w, name):
+        """Posts a new crash report of a watched server, unless it
+        has been claimed before; claiming happens on the loop only,
+        so no report is ever posted twice.
+        """
+
+        if self.watchdogs.get(w.server) is not w or name in w.reports:
+            return
+        if not name.endswith('.txt'):
+            return
+        w.reports.add(name)
+        log.info(f'WD: New crash report for {w.server}: {name}')
+        w.crashed = name
+        w.crashedat = monotonic()
+        w.posting = self.loop.create_task(self._postCrash(w, name))
+
+    def _readReport(self, rpath):
+        return rpath, os.path.getmtime(rpath), parsereport(rpath)
+
+    async def _postCrash(self, w, name):
+        try:
+            crash = await self.loop.run_in_executor(
+                None, self._readReport, f'{self._reportspath(w.server)}/{name}'
+            )
+        except OSError as e:
+            log.warning(f'WD: Could not read crash report {name}: {e}')
+            report = [f'> {name}\n< Could not read the report! >']
+        else:
+            report = await self._formatCrash(w.server, crash)
+        await self.serverGone(w, True, report)
+
+    async def _formatCrash(self, server, crash):
+        """Records a crash under its signature, returning the full report
+        for its first occurrence in a while, and only a summary for
+        repeats, so a crash loop does not flood the channel.
+        """
+
+        rpath, mtime, (ctime, desc, strace, flav, lev, bl, ph, th) = crash
+        sig, entry = recordCrash(self.crashsigs, server, os.path.basename(rpath),
+                                 mtime, strace, desc)
+        await self.crashsigs.save()
+        if entry['streak'] > 1:
+            return [f'> {os.path.basename(rpath)}\n# {desc}' + describeCrash(sig, entry)]
+        report = formatreport(rpath, ctime, desc, flav, strace, lev, bl, ph, th)
+        report[0] += '\n' + describeCrash(sig, entry)
+        return report
+
+    def _lookup(self, servers):
+        return {s: getProc(s, self.servercfg['serverspath']) for s in servers}
+
+    def _setUp(self, w, proc):
+        w.state = UP
+        w.proc = proc
+        w.crashed = None
+        w.posting = None
+        w.exited = self.loop.create_task(waitForExit(proc, self.loop))
+        self._watchReports(w)
+
+    def _setGone(self, w, delay=30):
+        w.state = GONE
+        w.proc = None
+        w.exited = None
+        w.nextcheck = monotonic() + delay
+        self.wake.set()
+
+    def _crashedRecently(self, w):
+        return w.crashed is not None and monotonic() - w.crashedat < crashwindow
+
+    async def _serverExited(self, w):
+        # Reports are written before the process exits, so usually one
+        # has been claimed already; if not, look for any the directory
+        # watch could not see, or give a late one a moment.
+        if not self._crashedRecently(w):
+            await asyncio.sleep(2, loop=self.loop)
+            await self._claimReports(w)
+        if self.watchdogs.get(w.server) is not w:
+            return
+        self._watchReports(w)
+        if not self._crashedRecently(w):
+            await self.serverGone(w, False)
+            return
+        w.state = CRASHED
+        try:
+            await w.posting
+            await self.startServer(w)
+        finally:
+            if self.watchdogs.get(w.server) is w:
+                self._setGone(w, 0)
+
+    async def _supervise(self):
+        """Watches all registered servers from a single task.
+
+        Up servers are waited on via their exit notifications,
+        gone servers are checked for their return every 30 seconds,
+        crashed and restarting servers are left to their handlers.
+        """
+        log.info('WD: Supervisor started.')
+        while self.watchdogs:
+            self.wake.clear()
+            exits = {w.exited: w for w in self.watchdogs.values() if w.state == UP}
+            gone = [w for w in self.watchdogs.values() if w.state == GONE]
+            timeout = None
+            if gone:
+                timeout = max(0, min(w.nextcheck for w in gone) - monotonic())
+            waker = self.loop.create_task(self.wake.wait())
+            done, _ = await asyncio.wait([waker, *exits], timeout=timeout, loop=self.loop,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            waker.cancel()
+
+            for fut in done:
+                w = exits.get(fut)
+                if w is None or self.watchdogs.get(w.server) is not w:
+                    continue
+                log.info(f'WD: {w.server} is gone!')
+                self._setGone(w)
+                self.loop.create_task(self._serverExited(w))
+
+            due = [w for w in self.watchdogs.values()
+                   if w.state == GONE and w.nextcheck <= monotonic()]
+            if not due:
+                continue
+            procs = await self.loop.run_in_executor(None, self._lookup, [w.server for w in due])
+            for w in due:
+                if self.watchdogs.get(w.server) is not w or w.state != GONE:
+                    continue
+                if procs[w.server]:
+                    log.info(f'WD: {w.server} is back online!')
+                    self._setUp(w, procs[w.server])
+                    self.loop.create_task(self.serverBack(w))
                 else:
-                    return
+                    w.nextcheck = monotonic() + 30
+        log.info('WD: Supervisor exited, no servers left to watch.')
+
+    def _supervisorDone(self, future):
+        if future.cancelled():
+            return
+        if future.exception():
+            log.warning('WD: Exception in watchdog supervisor!')
+            log.warning(future.exception())
 
-            event = Event()
-            watchFuture = self.loop.run_in_executor(None, watch, event)
-            watchFuture.add_done_callback(watchDone)
-            self.watchdogs[server] = (watchFuture, event)
-            await ctx.sendmarkdown('# Watchdog activated!', deletable=False)
+    async def _wdstart(self, ctx, server):
+        if server in self.watchdogs:
+            log.info(f'{server} watchdog active.')
+            await ctx.sendmarkdown('# Watchdog already active!')
+            return
+        if server not in self.servercfg['servers']:
+            log.warning(f'{server} has been misspelled or not configured!')
+            await ctx.sendmarkdown(f'< {server} has been misspelled or not configured! >')
+            return
+
+        proc = await self.loop.run_in_executor(
+            None, getProc, server, self.servercfg['serverspath']
+        )
+        w = ServerWatch(server, ctx)
+        # Reports already there are not news, the directory is
+        # listed before being watched, so none can slip through.
+        w.reports = set(await self.loop.run_in_executor(None, self._reportNames, server))
+        if proc:
+            log.info('Starting watchdog on online server.')
+            await ctx.sendmarkdown(f'# {server} is up and running.', deletable=False)
+            self._setUp(w, proc)
+        else:
+            log.info('Starting watchdog on offline server.')
+            await ctx.sendmarkdown(f'< {server} is not running. >', deletable=False)
+            self._setGone(w)
+        self.watchdogs[server] = w
+        self._watchReports(w)
+        log.info(f'WD: Starting watch on {server}.')
+
+        if self.supervisor is None or self.supervisor.done():
+            self.supervisor = self.loop.create_task(self._supervise())
+            self.supervisor.add_done_callback(self._supervisorDone)
+        self.wake.set()
+        await ctx.sendmarkdown('# Watchdog activated!', deletable=False)
 
     @watchdog.command(name='activate', aliases=['start', 'watch'])
     async def wdstart(self, ctx, *servers: str):
@@ -204,10 +417,15 @@ class Watchdog(commands.Cog):
     async def wdstop(self, ctx, server: str):
         """Stop the process watchdog for a server."""
 
-        if server in self.watchdogs and not self.watchdogs[server][0].done():
-            watcher = self.watchdogs[server]
-            watcher[1].set()
+        if server in self.watchdogs:
             await ctx.sendmarkdown(f'> Terminating {server} watchdog...', deletable=False)
+            w = self.watchdogs.pop(server)
+            if w.exited:
+                w.exited.cancel()
+            self._unwatchReports(w)
+            self.wake.set()
+            log.info(f'WD: Ending watch on {server}.')
+            await w.ctx.sendmarkdown(f'> Ended watch on {server}!', deletable=False)
         else:
             if server not in self.servercfg['servers']:
                 log.warning(f'{server} has been misspelled or not configured!')
@@ -224,5 +442,8 @@ def setup(bot):
         bot.servercfg = Config(f'{bot.dir}/configs/serverCfgs.toml',
                                default=default,
                                load=True, loop=bot.loop)
+    if not hasattr(bot, 'crashsigs'):
+        bot.crashsigs = Config(f'{bot.dir}/configs/crashsigs.json',
+                               load=True, loop=bot.loop)
     bot.register_nodes([f'{__name__}.watchdog'])
     bot.add_cog(Watchdog(bot))
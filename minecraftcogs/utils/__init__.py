@@ -1,4 +1,17 @@
-from .mcservutils import isUp, termProc, getProc, sendCmd, sendCmds, exec_cmd, \
-    serverStart, serverStop, serverTerminate, serverStatus, buildCountdownSteps, \
-    getcrashreport, parsereport, formatreport
+from .mcservutils import isUp, termProc, getProc, getProcIndex, invalidateProcIndex, \
+    waitForExit, sendCmd, sendCmds, sendCmdCapture, fanout, exec_cmd, serverStart, \
+    serverStop, waitForStop, serverTerminate, serverStatus, buildCountdownSteps, CrashIndex, \
+    getCrashIndex, getcrashreport, parsereport, formatreport
+from .crashsigs import normalizeFrame, crashSignature, recordCrash, describeCrash
+from .inotify import Inotify, getInotify, IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE, IN_IGNORED
+from .logtail import LogCursor, LogTailer, subscribeLog, captureOutput, waitForReady
+from .logsearch import logarchives, logfiles, searchfile
+from .logstore import LogStore, logentry, scanlog
+from .logindex import LogIndex, getLogIndex, readwindow, clip
+from .logevents import LogEvent, Join, Leave, Chat, Death, Command, Warn, Error, \
+    parseLine, LogParser, parseStream
+from .sessions import PlaytimeStore, getPlaytimeStore
+from .outbatch import OutputBatcher
+from .mcstats import ResourceSampler, RingBuffer
+from .rcon import RconPool, getRconPool, closeRconPools, rconException, rconNoResponse
 from .mcuser import getUUID, getUserData, MCUser, mojException
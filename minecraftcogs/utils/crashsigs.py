@@ -0,0 +1,87 @@
+import hashlib
+import re
+from time import strftime, localtime
+
+sigframes = 8
+streakgap = 6 * 3600
+
+_normalizers = (
+    (re.compile(r'\(([^():]+):\d+\)'), r'(\1)'),
+    (re.compile(r'\$\$Lambda\$\d+/(?:0x)?[0-9a-fA-F]+'), '$$Lambda$'),
+    (re.compile(r'lambda\$(\w+)\$\d+'), r'lambda$\1$'),
+    (re.compile(r'(Generated(?:Constructor|SerializationConstructor)?(?:Method)?Accessor)\d+'), r'\1'),
+    (re.compile(r'0x[0-9a-fA-F]+'), '0x'),
+    (re.compile(r'@[0-9a-fA-F]{4,}'), '@'),
+    (re.compile(r'\s+(?:~|\[|\{).*$'), ''),
+)
+
+
+def normalizeFrame(frame):
+    """Strips a stack frame of everything that differs between two
+    occurrences of the same crash: line numbers, addresses, lambda
+    and accessor ids, and jar and transformer annotations.
+    """
+
+    frame = frame.strip()
+    for pattern, repl in _normalizers:
+        frame = pattern.sub(repl, frame)
+    return frame
+
+
+def crashSignature(strace, frames=sigframes):
+    """Fingerprints a crash by its exception type and the top frames
+    of its normalized stack trace.
+
+    Returns the signature, the exception type and the top frame.
+    """
+
+    exception = strace[0].split(':', 1)[0].strip() if strace else ''
+    top = [normalizeFrame(l) for l in strace[1:] if l.strip().startswith('at ')][:frames]
+    digest = hashlib.sha1('\n'.join([exception, *top]).encode('utf-8')).hexdigest()[:12]
+    return digest, exception, top[0][3:] if top else ''
+
+
+def recordCrash(crashsigs, server, rname, mtime, strace, desc):
+    """Records a crash report under its signature, unless it has
+    been recorded before.
+
+    crashsigs is the bot's shared crash signature store,
+    mapping servers to their signatures and recorded reports.
+    Occurrences less than streakgap seconds apart count as a streak;
+    reports may be recorded out of order, older ones only count
+    towards the streak if they fall within it.
+    Returns the signature and its entry.
+    """
+
+    if server not in crashsigs:
+        crashsigs[server] = {'sigs': {}, 'reports': {}}
+    records = crashsigs[server]
+    if rname in records['reports']:
+        sig = records['reports'][rname]
+        return sig, records['sigs'][sig]
+    sig, exception, frame = crashSignature(strace)
+    entry = records['sigs'].get(sig)
+    if entry is None:
+        entry = records['sigs'][sig] = {
+            'exception': exception, 'frame': frame, 'desc': desc.strip(),
+            'count': 0, 'first': mtime, 'last': mtime, 'streak': 0, 'streakstart': mtime
+        }
+    if mtime - entry['last'] > streakgap:
+        entry['streak'] = 0
+        entry['streakstart'] = mtime
+    if mtime >= entry['streakstart'] - streakgap:
+        entry['streak'] += 1
+    entry['count'] += 1
+    entry['first'] = min(entry['first'], mtime)
+    entry['last'] = max(entry['last'], mtime)
+    records['reports'][rname] = sig
+    return sig, entry
+
+
+def describeCrash(sig, entry):
+    """Summarizes how often a crash signature has been seen."""
+
+    since = strftime('%H:%M', localtime(entry['streakstart']))
+    first = strftime('%Y-%m-%d %H:%M', localtime(entry['first']))
+    return (f'# Signature {sig}: seen {entry["streak"]}x since {since}, '
+            f'{entry["count"]}x in total, first at {first}\n')
@@ -0,0 +1,115 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+
+log = logging.getLogger('charfred')
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_MASK_ADD = 0x20000000
+
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_header = struct.Struct('iIII')
+
+_libc = None
+
+
+def _getlibc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        _libc.inotify_init1
+    return _libc
+
+
+class Inotify:
+    """Minimal inotify binding, delivering events into an asyncio loop.
+
+    Raises OSError if inotify is not available on this platform,
+    so callers can fall back to polling.
+    """
+
+    def __init__(self, loop):
+        try:
+            libc = _getlibc()
+        except (OSError, AttributeError) as e:
+            raise OSError(f'inotify unavailable: {e}')
+        self.libc = libc
+        self.loop = loop
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.callbacks = {}
+        loop.add_reader(self.fd, self._readable)
+
+    def add_watch(self, path, mask, callback):
+        """Watches a path, calling callback(mask, name) for each event.
+
+        Returns the watch descriptor.
+        """
+
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask | IN_MASK_ADD)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        self.callbacks.setdefault(wd, []).append(callback)
+        return wd
+
+    def rm_watch(self, wd, callback):
+        callbacks = self.callbacks.get(wd, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if not callbacks:
+            self.callbacks.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def _readable(self):
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        i = 0
+        while i < len(data):
+            wd, mask, _, length = _header.unpack_from(data, i)
+            i += _header.size
+            name = data[i:i + length].rstrip(b'\0').decode('utf-8', errors='replace')
+            i += length
+            for callback in list(self.callbacks.get(wd, ())):
+                try:
+                    callback(mask, name)
+                except Exception:
+                    log.exception('Exception in inotify callback!')
+            if mask & IN_IGNORED:
+                self.callbacks.pop(wd, None)
+
+    def close(self):
+        self.loop.remove_reader(self.fd)
+        os.close(self.fd)
+        self.callbacks = {}
+
+
+_instances = {}
+
+
+def getInotify(loop):
+    """Returns the shared Inotify instance for a given loop,
+    or None if inotify is not available.
+    """
+
+    if loop not in _instances:
+        try:
+            _instances[loop] = Inotify(loop)
+        except OSError as e:
+            log.info(f'Falling back to polling: {e}')
+            _instances[loop] = None
+    return _instances[loop]
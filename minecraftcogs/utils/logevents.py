@@ -0,0 +1,190 @@
+import re
+
+linepat = re.compile(
+    r'^\[(?P<h>\d\d):(?P<m>\d\d):(?P<s>\d\d)\] \[(?P<thread>.+?)/(?P<level>[A-Z]+)\]'
+    r'(?: \[[^\]]*\])?: (?P<msg>.*)$'
+)
+joinpat = re.compile(r'^(?P<player>\w+) joined the game$')
+leavepat = re.compile(r'^(?P<player>\w+) left the game$')
+chatpat = re.compile(r'^<(?P<player>[^>]+)> (?P<text>.*)$')
+commandpat = re.compile(r'^(?P<player>\w+) issued server command: (?P<text>.*)$')
+deathpat = re.compile(
+    r'^(?P<player>\w{3,16}) (?P<text>(?:was|fell|drowned|died|blew up|burned|went up|went off'
+    r'|walked into|tried to|hit the ground|froze|starved|suffocated|withered|experienced'
+    r'|didn\'t want|discovered|got finished|left the confines)\b.*)$'
+)
+
+
+class LogEvent:
+    """Base of all log events.
+
+    time is in seconds since midnight of the day parsing began,
+    thread and level are as logged.
+    """
+
+    __slots__ = ('time', 'thread', 'level')
+    kind = None
+
+    def __init__(self, time, thread, level):
+        self.time = time
+        self.thread = thread
+        self.level = level
+
+    def __repr__(self):
+        fields = ', '.join(f'{k}={getattr(self, k)!r}' for k in self._fields())
+        return f'{type(self).__name__}({fields})'
+
+    @classmethod
+    def _fields(cls):
+        fields = []
+        for c in reversed(cls.__mro__):
+            fields.extend(getattr(c, '__slots__', ()))
+        return fields
+
+
+class PlayerEvent(LogEvent):
+    __slots__ = ('player',)
+
+    def __init__(self, time, thread, level, player):
+        super().__init__(time, thread, level)
+        self.player = player
+
+
+class Join(PlayerEvent):
+    __slots__ = ()
+    kind = 'join'
+
+
+class Leave(PlayerEvent):
+    __slots__ = ()
+    kind = 'leave'
+
+
+class PlayerText(PlayerEvent):
+    __slots__ = ('text',)
+
+    def __init__(self, time, thread, level, player, text):
+        super().__init__(time, thread, level, player)
+        self.text = text
+
+
+class Chat(PlayerText):
+    __slots__ = ()
+    kind = 'chat'
+
+
+class Death(PlayerText):
+    __slots__ = ()
+    kind = 'death'
+
+
+class Command(PlayerText):
+    __slots__ = ()
+    kind = 'command'
+
+
+class Problem(LogEvent):
+    __slots__ = ('message',)
+
+    def __init__(self, time, thread, level, message):
+        super().__init__(time, thread, level)
+        self.message = message
+
+
+class Warn(Problem):
+    __slots__ = ()
+    kind = 'warn'
+
+
+class Error(Problem):
+    __slots__ = ()
+    kind = 'error'
+
+
+def _classify(secs, thread, level, msg):
+    if level == 'WARN':
+        return Warn(secs, thread, level, msg)
+    if level in ('ERROR', 'FATAL'):
+        return Error(secs, thread, level, msg)
+    if level != 'INFO':
+        return None
+    # Cheap checks first, so most lines never reach a regex.
+    if msg.startswith('<'):
+        m = chatpat.match(msg)
+        if m:
+            return Chat(secs, thread, level, m.group('player'), m.group('text'))
+    if msg.endswith(' the game'):
+        m = joinpat.match(msg)
+        if m:
+            return Join(secs, thread, level, m.group('player'))
+        m = leavepat.match(msg)
+        if m:
+            return Leave(secs, thread, level, m.group('player'))
+    if ' issued server command: ' in msg:
+        m = commandpat.match(msg)
+        if m:
+            return Command(secs, thread, level, m.group('player'), m.group('text'))
+    if thread.startswith('Server thread'):
+        m = deathpat.match(msg)
+        if m:
+            return Death(secs, thread, level, m.group('player'), m.group('text'))
+    return None
+
+
+def parseLine(line):
+    """Parses a single log line into an event, or None if it is not
+    one of the known kinds; time is in seconds since midnight.
+    """
+
+    m = linepat.match(line)
+    if m is None:
+        return None
+    h, mi, s, thread, level, msg = m.group('h', 'm', 's', 'thread', 'level', 'msg')
+    return _classify(int(h) * 3600 + int(mi) * 60 + int(s), thread, level, msg)
+
+
+class LogParser:
+    """Parses a stream of log lines into events, keeping count of the
+    days passed, since log lines only carry the time of day.
+    """
+
+    def __init__(self, days=0, last=0):
+        self.days = days
+        self.last = last
+
+    def tick(self, secs):
+        """Advances to a given time of day, counting a day whenever
+        it goes backwards; returns the seconds since parsing began.
+        """
+
+        if secs < self.last - 60:
+            self.days += 1
+        self.last = secs
+        return self.days * 86400 + secs
+
+    def parse(self, line):
+        """Parses a single line, returns an event or None."""
+
+        m = linepat.match(line)
+        if m is None:
+            return None
+        secs = int(m.group('h')) * 3600 + int(m.group('m')) * 60 + int(m.group('s'))
+        return _classify(self.tick(secs), *m.group('thread', 'level', 'msg'))
+
+    def feed(self, lines):
+        """Yields the events of the given lines."""
+
+        for line in lines:
+            event = self.parse(line)
+            if event is not None:
+                yield event
+
+
+async def parseStream(sub, parser=None):
+    """Yields the events of a log subscription as they are logged."""
+
+    parser = parser or LogParser()
+    async for line in sub:
+        event = parser.parse(line)
+        if event is not None:
+            yield event
@@ -0,0 +1,166 @@
+import gzip
+import logging
+import os
+import re
+from bisect import bisect_left, bisect_right
+from .logstore import LogStore, logentry, scanlog, startday, timepat
+
+log = logging.getLogger('charfred')
+
+clockpat = re.compile(timepat.pattern.decode())
+
+markinterval = 300
+
+
+def _relative(day0, when):
+    """Converts a datetime into seconds since midnight of day0,
+    the ordinal of the day a log began.
+    """
+
+    return ((when.date().toordinal() - day0) * 86400 +
+            when.hour * 3600 + when.minute * 60 + when.second)
+
+
+class LogIndex(LogStore):
+    """Persistent index of a server's logs, mapping times to the
+    uncompressed byte offsets of the lines logged at them.
+
+    Log lines only carry the time of day, so times are kept as seconds
+    since midnight of the day a log began, counting a day whenever the
+    time of day goes backwards. A mark is set every markinterval seconds.
+
+    Archives are indexed once, latest.log is indexed incrementally
+    from where the last update stopped. The index is stored next to
+    the logs in .logindex.json.
+    """
+
+    filename = '.logindex.json'
+    tag = 'LI'
+
+    def _scan(self, f, entry):
+        """Reads complete lines from f, starting at the entry's scanned
+        offset, and sets marks for them.
+        """
+
+        marks = entry['marks']
+        for offset, rel, _ in scanlog(f, entry):
+            if not marks or rel >= marks[-1][0] + markinterval:
+                marks.append([rel, offset])
+
+    def _updateArchive(self, name, day):
+        files = self.data['files']
+        path = f'{self.logspath}/{name}'
+        st = os.stat(path)
+        ident = [st.st_size, st.st_mtime]
+        entry = files.get(name)
+        if entry and entry['ident'] == ident:
+            return False
+        entry = logentry(ident, day.toordinal(), marks=[])
+        try:
+            with gzip.open(path, 'rb') as f:
+                self._scan(f, entry)
+        except (OSError, EOFError) as e:
+            log.warning(f'LI: Could not index {path}: {e}')
+        files[name] = entry
+        return True
+
+    def _updateLatest(self):
+        files = self.data['files']
+        path = f'{self.logspath}/latest.log'
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return files.pop('latest.log', None) is not None
+        with f:
+            st = os.fstat(f.fileno())
+            entry = files.get('latest.log')
+            if entry is None or entry['ident'] != [st.st_ino] or st.st_size < entry['scanned']:
+                entry = logentry([st.st_ino], marks=[])
+            elif st.st_size == entry['scanned']:
+                return False
+            f.seek(entry['scanned'])
+            self._scan(f, entry)
+        startday(entry, st.st_mtime)
+        files['latest.log'] = entry
+        return True
+
+    def window(self, path, since=None, until=None):
+        """Returns the uncompressed start and end offsets enclosing all
+        lines of a given log file logged between since and until,
+        end being None for the end of the file.
+
+        The window may include up to markinterval seconds of lines
+        before since and after until.
+        """
+
+        entry = (self.data or {}).get('files', {}).get(os.path.basename(path))
+        if entry is None or entry['day0'] is None:
+            return 0, None
+        times = [m[0] for m in entry['marks']]
+        if times and ((since and _relative(entry['day0'], since) > entry['days'] * 86400 + entry['last'])
+                      or (until and _relative(entry['day0'], until) < times[0])):
+            return 0, 0
+        start, end = 0, None
+        if since:
+            i = bisect_right(times, _relative(entry['day0'], since)) - 1
+            if i >= 0:
+                start = entry['marks'][i][1]
+        if until:
+            i = bisect_left(times, _relative(entry['day0'], until) + 1)
+            if i < len(times):
+                end = entry['marks'][i][1]
+        return start, end
+
+
+def readwindow(path, start=0, end=None):
+    """Returns the lines of a log file between the given uncompressed
+    offsets.
+
+    Gzipped files can not be seeked into, so they are decompressed up
+    to start without decoding any lines, and reading stops at end.
+    """
+
+    opener = gzip.open if path.endswith('.gz') else open
+    try:
+        with opener(path, 'rb') as f:
+            f.seek(start)
+            data = f.read() if end is None else f.read(max(0, end - start))
+    except (OSError, EOFError):
+        return []
+    lines = data.split(b'\n')
+    if lines and not lines[-1]:
+        lines.pop()
+    return [l.decode('utf-8', errors='replace').rstrip('\r') for l in lines]
+
+
+def clip(lines, since, until):
+    """Drops the lines logged before since or after until, going by
+    their time of day only, so the two may be at most a day apart.
+    Lines without a time of their own share the fate of the line
+    before them.
+    """
+
+    start = since.hour * 3600 + since.minute * 60 + since.second
+    stop = until.hour * 3600 + until.minute * 60 + until.second
+    wraps = stop < start
+    keep = False
+    clipped = []
+    for line in lines:
+        t = clockpat.match(line)
+        if t:
+            secs = int(t.group(1)) * 3600 + int(t.group(2)) * 60 + int(t.group(3))
+            keep = (start <= secs or secs <= stop) if wraps else start <= secs <= stop
+        if keep:
+            clipped.append(line)
+    return clipped
+
+
+_indexes = {}
+
+
+def getLogIndex(logspath):
+    """Returns the shared LogIndex for a given logs directory."""
+
+    if logspath not in _indexes:
+        _indexes[logspath] = LogIndex(logspath)
+    return _indexes[logspath]
@@ -0,0 +1,95 @@
+import gzip
+import os
+import re
+from datetime import date, datetime
+
+archivepat = re.compile(r'^(?P<date>\d{4}-\d{2}-\d{2})-(?P<n>\d+)\.log\.gz$')
+
+
+def logarchives(logspath):
+    """Lists a server's archived logs as the day each began, its
+    number on that day and its name, oldest first.
+
+    Returns None if the logs directory can not be listed.
+    """
+
+    try:
+        names = os.listdir(logspath)
+    except OSError:
+        return None
+    archives = []
+    for name in names:
+        m = archivepat.match(name)
+        if not m:
+            continue
+        try:
+            day = datetime.strptime(m.group('date'), '%Y-%m-%d').date()
+        except ValueError:
+            continue
+        archives.append((day, int(m.group('n')), name))
+    archives.sort()
+    return archives
+
+
+def logfiles(logspath, since=None, until=None):
+    """Lists a server's archived logs and latest.log, oldest first.
+
+    Archives are named after the day their log began, and a log runs
+    until the next one begins, so logs lying entirely outside of the
+    given since and until dates are left out, without opening them.
+    """
+
+    archives = logarchives(logspath)
+    if archives is None:
+        return []
+    logs = [(day, n, f'{logspath}/{name}') for day, n, name in archives]
+    latest = f'{logspath}/latest.log'
+    if os.path.isfile(latest):
+        began = logs[-1][0] if logs else date.min
+        logs.append((began, 0, latest))
+        lastday = date.fromtimestamp(os.path.getmtime(latest))
+    else:
+        lastday = date.today()
+
+    files = []
+    for i, (began, _, path) in enumerate(logs):
+        # When latest.log began is not known, so neither is when the
+        # newest archive ended.
+        ended = logs[i + 1][0] if i + 1 < len(logs) and logs[i + 1][2] != latest else lastday
+        if since and ended < since:
+            continue
+        if until and began > until:
+            continue
+        files.append(path)
+    return files
+
+
+def searchfile(path, pattern, limit, start=0, end=None):
+    """Searches a single log file for a regex pattern,
+    decompressing it if it is gzipped.
+
+    Only the lines between the given uncompressed offsets are searched.
+    Meant to be run in a process pool.
+    Returns the path and up to limit matching lines.
+    """
+
+    regex = re.compile(pattern)
+    matches = []
+    opener = gzip.open if path.endswith('.gz') else open
+    try:
+        with opener(path, 'rb') as f:
+            if start:
+                f.seek(start)
+            pos = start
+            for line in f:
+                if end is not None and pos >= end:
+                    break
+                pos += len(line)
+                line = line.decode('utf-8', errors='replace').rstrip('\r\n')
+                if regex.search(line):
+                    matches.append(line)
+                    if len(matches) >= limit:
+                        break
+    except (OSError, EOFError):
+        pass
+    return path, matches
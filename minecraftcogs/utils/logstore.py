@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+import re
+import threading
+from datetime import date
+from .logevents import LogParser
+from .logsearch import logarchives
+
+log = logging.getLogger('charfred')
+
+timepat = re.compile(rb'^\[(\d\d):(\d\d):(\d\d)\]')
+
+_readsize = 1 << 20
+
+
+def logentry(ident, day0=None, **fields):
+    """Returns a new entry for keeping track of a single log file."""
+
+    return {'ident': ident, 'day0': day0, 'days': 0, 'last': 0, 'scanned': 0, **fields}
+
+
+def scanlog(f, entry):
+    """Yields the offset, time and raw content of every complete line
+    with a time of day read from f, starting at the entry's scanned
+    offset, and keeps the entry up to date with what was read.
+
+    Times are in seconds since midnight of the day the log began,
+    the days passed are counted by a LogParser.
+    """
+
+    parser = LogParser(entry['days'], entry['last'])
+    offset = entry['scanned']
+    partial = b''
+    while True:
+        data = f.read(_readsize)
+        if not data:
+            break
+        lines = (partial + data).split(b'\n')
+        partial = lines.pop()
+        for line in lines:
+            t = timepat.match(line)
+            if t:
+                yield offset, parser.tick(int(t.group(1)) * 3600 + int(t.group(2)) * 60 +
+                                          int(t.group(3))), line
+            offset += len(line) + 1
+    entry['days'], entry['last'] = parser.days, parser.last
+    entry['scanned'] = offset
+
+
+def startday(entry, mtime):
+    """Sets the day a latest.log began, if not known yet.
+
+    It is only known by counting back from the day the log was
+    last written to, so it is set once the log has been scanned.
+    """
+
+    if entry['day0'] is None:
+        entry['day0'] = date.fromtimestamp(mtime).toordinal() - entry['days']
+
+
+class LogStore:
+    """Base of persistent, incrementally updated stores of data derived
+    from a server's logs, kept next to them as filename.
+
+    Per log file an entry is kept under files; subclasses update them
+    in _updateArchive and _updateLatest, entries of log files no longer
+    present are dropped.
+    """
+
+    filename = None
+    tag = None
+
+    def __init__(self, logspath):
+        self.logspath = logspath
+        self.path = f'{logspath}/{self.filename}'
+        self.lock = threading.Lock()
+        self.data = None
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+        if 'files' not in self.data:
+            self.data = {'files': {}}
+
+    def _save(self):
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self.data, f, separators=(',', ':'))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning(f'{self.tag}: Could not save {self.path}: {e}')
+
+    def _updateArchive(self, name, day):
+        raise NotImplementedError
+
+    def _updateLatest(self):
+        raise NotImplementedError
+
+    def _update(self):
+        """Brings the entries up to date, archives oldest first,
+        returns whether anything changed.
+        """
+
+        archives = logarchives(self.logspath)
+        if archives is None:
+            return False
+        files = self.data['files']
+        changed = False
+        for day, _, name in archives:
+            changed |= self._updateArchive(name, day)
+        changed |= self._updateLatest()
+        present = {name for _, _, name in archives}
+        present.add('latest.log')
+        for name in set(files) - present:
+            del files[name]
+            changed = True
+        return changed
+
+    def update(self, *args):
+        """Brings the store up to date with the logs on disk.
+
+        Blocking, meant to be run in an executor.
+        """
+
+        with self.lock:
+            if self.data is None:
+                self._load()
+            if self._update(*args):
+                self._save()
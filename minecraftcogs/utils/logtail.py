@@ -0,0 +1,282 @@
+import asyncio
+import logging
+import os
+import re
+from time import monotonic
+from .inotify import getInotify, IN_MODIFY, IN_CREATE, IN_DELETE, IN_MOVED_FROM, IN_MOVED_TO
+
+log = logging.getLogger('charfred')
+
+donepat = re.compile(r'Done \((?P<secs>[\d.,]+)s\)!')
+
+
+class LogCursor:
+    """Incrementally reads complete lines appended to a log file,
+    starting from the file's size at creation time, or a given offset.
+
+    The file is kept open, so when it is rotated away, as happens when
+    a server starts and archives its previous log, the remainder of the
+    old file is drained before continuing at the new file's beginning;
+    no line is missed or read twice. A file truncated in place is
+    read again from its beginning.
+    """
+
+    def __init__(self, path, offset=None):
+        self.path = path
+        self.file = None
+        self.partial = b''
+        self._open(offset)
+
+    def _open(self, offset=0):
+        try:
+            self.file = open(self.path, 'rb')
+        except OSError:
+            self.file = None
+            return
+        if offset is None:
+            self.file.seek(0, 2)
+        else:
+            self.file.seek(offset)
+
+    @property
+    def offset(self):
+        return self.file.tell() if self.file else 0
+
+    def _split(self, data, final=False):
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        if final and self.partial:
+            lines.append(self.partial)
+            self.partial = b''
+        return [l.decode('utf-8', errors='replace').rstrip('\r') for l in lines]
+
+    def read(self):
+        """Returns all complete lines written since the last read."""
+
+        if self.file is None:
+            self._open()
+            if self.file is None:
+                return []
+        data = self.file.read()
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            inode = None
+        current = os.fstat(self.file.fileno())
+        if inode is not None and inode != current.st_ino:
+            # Rotated, drain what is left of the old file first.
+            lines = self._split(data + self.file.read(), final=True)
+            self.file.close()
+            self._open()
+            if self.file:
+                lines.extend(self._split(self.file.read()))
+            return lines
+        if current.st_size < self.file.tell():
+            # Truncated in place, start over.
+            self.file.seek(0)
+            self.partial = b''
+            data = self.file.read()
+        return self._split(data)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+class LogSubscription:
+    """A subscriber's view of a LogTailer; an async iterator of lines.
+
+    Lines that do not fit into the subscriber's bounded queue are
+    dropped and counted in skipped, rather than slowing the tailer down.
+    """
+
+    def __init__(self, tailer, maxsize):
+        self.tailer = tailer
+        self.queue = asyncio.Queue(maxsize=maxsize, loop=tailer.loop)
+        self.skipped = 0
+        self.closed = False
+
+    def put(self, line):
+        try:
+            self.queue.put_nowait(line)
+        except asyncio.QueueFull:
+            self.skipped += 1
+
+    async def get(self):
+        """Returns the next line, or None once the tailer has stopped."""
+
+        if self.closed and self.queue.empty():
+            return None
+        return await self.queue.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        line = await self.get()
+        if line is None:
+            raise StopAsyncIteration
+        return line
+
+    def close(self):
+        self.tailer.unsubscribe(self)
+
+
+class LogTailer:
+    """Tails a single log file, reading each new line once and
+    handing it to every subscriber.
+
+    Woken by inotify events on the log's directory where available,
+    polling otherwise.
+    """
+
+    pollinterval = 0.2
+
+    def __init__(self, path, loop):
+        self.path = path
+        self.loop = loop
+        self.cursor = LogCursor(path)
+        self.subscribers = set()
+        self.wake = asyncio.Event(loop=loop)
+        self.task = None
+        self.inotify = None
+        self.wd = None
+
+    def subscribe(self, maxsize=1024):
+        sub = LogSubscription(self, maxsize)
+        self.subscribers.add(sub)
+        if self.task is None:
+            self.task = self.loop.create_task(self._run())
+        return sub
+
+    def unsubscribe(self, sub):
+        sub.closed = True
+        self.subscribers.discard(sub)
+        if not self.subscribers:
+            self.stop()
+
+    def stop(self):
+        if _tailers.get(self.path) is self:
+            del _tailers[self.path]
+        if self.task:
+            self.task.cancel()
+        for sub in self.subscribers:
+            sub.closed = True
+            sub.put(None)
+        self.subscribers = set()
+
+    def _event(self, mask, name):
+        if name == os.path.basename(self.path):
+            self.wake.set()
+
+    def _watch(self):
+        self.inotify = getInotify(self.loop)
+        if self.inotify is None:
+            return
+        try:
+            self.wd = self.inotify.add_watch(
+                os.path.dirname(self.path),
+                IN_MODIFY | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO,
+                self._event
+            )
+        except OSError as e:
+            log.warning(f'LT: Cannot watch {self.path}, polling instead: {e}')
+            self.inotify = None
+
+    async def _run(self):
+        log.info(f'LT: Tailing {self.path}.')
+        self._watch()
+        # With inotify, the timeout is merely a safety net.
+        interval = self.pollinterval if self.inotify is None else 5
+        try:
+            while True:
+                for line in self.cursor.read():
+                    for sub in list(self.subscribers):
+                        sub.put(line)
+                try:
+                    await asyncio.wait_for(self.wake.wait(), interval, loop=self.loop)
+                except asyncio.TimeoutError:
+                    pass
+                self.wake.clear()
+        finally:
+            self.cursor.close()
+            if self.inotify and self.wd is not None:
+                self.inotify.rm_watch(self.wd, self._event)
+            log.info(f'LT: Stopped tailing {self.path}.')
+
+
+_tailers = {}
+
+
+def subscribeLog(path, loop, maxsize=1024):
+    """Subscribes to the lines appended to a given log file from now on,
+    sharing one tailer among all subscribers of the same file.
+    """
+
+    tailer = _tailers.get(path)
+    if tailer is None:
+        tailer = _tailers[path] = LogTailer(path, loop)
+    return tailer.subscribe(maxsize)
+
+
+async def _nextLine(loop, sub, timeout):
+    try:
+        return await asyncio.wait_for(sub.get(), timeout, loop=loop)
+    except asyncio.TimeoutError:
+        return None
+
+
+async def captureOutput(loop, logpath, coro, window=2.0, quiet=0.5,
+                        match='[Server thread/'):
+    """Awaits a given coroutine, which is expected to make a server
+    write to its log, and collects the log lines written afterwards.
+
+    Reading stops after window seconds, or once no new lines have
+    appeared for quiet seconds after the first one.
+    Returns the coroutine's result and the collected lines
+    containing match.
+    """
+
+    sub = subscribeLog(logpath, loop)
+    try:
+        result = await coro
+        lines = []
+        deadline = monotonic() + window
+        while True:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            line = await _nextLine(loop, sub, min(remaining, quiet) if lines else remaining)
+            if line is None:
+                if lines or sub.closed:
+                    break
+                continue
+            if match in line:
+                lines.append(line)
+    finally:
+        sub.close()
+    return result, lines
+
+
+async def waitForReady(loop, sub, timeout, proc=None):
+    """Reads a server's log from a given subscription until the server
+    reports that it is done loading.
+
+    Gives up after timeout seconds, or early if a given process exits.
+    Returns the startup time the server reported, or None.
+    """
+
+    deadline = monotonic() + timeout
+    while True:
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            return None
+        line = await _nextLine(loop, sub, min(remaining, 1))
+        if line is None:
+            if sub.closed or (proc is not None and not proc.is_running()):
+                return None
+            continue
+        done = donepat.search(line)
+        if done:
+            return float(done.group('secs').replace(',', '.'))
@@ -3,75 +3,370 @@ import asyncio
 import logging
 import os
 import re
-import glob
 import functools
+import json
+import mmap
+import threading
+from time import monotonic
+from .rcon import getRconPool, rconException, rconNoResponse
+from .logtail import subscribeLog, captureOutput, waitForReady
 
 log = logging.getLogger('charfred')
 
 
-def isUp(server):
+_procindex = {}
+_procindexstamp = 0.0
+_procindexttl = 2.0
+_procindexlock = threading.Lock()
+
+
+def _buildProcIndex():
+    """Walks the process table once and maps each server name
+    to the Process running its jar.
+    """
+
+    index = {}
+    for process in psutil.process_iter(attrs=['cmdline']):
+        for arg in process.info['cmdline'] or ():
+            if arg.endswith('.jar'):
+                index[arg[:-4]] = process
+    return index
+
+
+def getProcIndex():
+    """Returns the cached server to Process map,
+    rebuilding it if it is older than its TTL.
+    """
+
+    global _procindex, _procindexstamp
+    with _procindexlock:
+        if (monotonic() - _procindexstamp) > _procindexttl:
+            _procindex = _buildProcIndex()
+            _procindexstamp = monotonic()
+        return _procindex
+
+
+def invalidateProcIndex():
+    """Forces the next lookup to rebuild the process index."""
+
+    global _procindexstamp
+    with _procindexlock:
+        _procindexstamp = 0.0
+
+
+_pids = {}
+
+
+def _pidfile(server, serverspath):
+    return f'{serverspath}/{server}/charfred.pid'
+
+
+def _readPids(server, serverspath):
+    """Reads the pidfile of a given server, if there is one."""
+
+    try:
+        with open(_pidfile(server, serverspath), 'r') as pf:
+            pids = json.load(pf)
+        return tuple(pids['server'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _findServerPids(server):
+    """Finds the screen session running a given server and
+    the java process within it, in a single process table scan.
+    """
+
+    for process in psutil.process_iter(attrs=['name', 'cmdline']):
+        if 'screen' not in (process.info['name'] or '').lower():
+            continue
+        cmdline = process.info['cmdline'] or []
+        try:
+            i = cmdline.index('-dmS')
+        except ValueError:
+            continue
+        if cmdline[i + 1:i + 2] != [server]:
+            continue
+        try:
+            for child in process.children(recursive=True):
+                if any(arg.endswith('.jar') for arg in child.cmdline()):
+                    return process, child
+        except psutil.Error:
+            pass
+        return process, None
+    return None, None
+
+
+def _recordPids(server, serverspath):
+    """Records the pids of a server's screen session and java process
+    in memory and in the server's pidfile.
+
+    Returns a boolean indicating whether the java process was found.
+    """
+
+    screen, java = _findServerPids(server)
+    if java is None:
+        return False
+    try:
+        pids = {
+            'screen': [screen.pid, screen.create_time()],
+            'server': [java.pid, java.create_time()]
+        }
+    except psutil.Error:
+        return False
+    _pids[server] = tuple(pids['server'])
+    try:
+        with open(_pidfile(server, serverspath), 'w') as pf:
+            json.dump(pids, pf)
+    except OSError as e:
+        log.warning(f'Could not write pidfile for {server}: {e}')
+    return True
+
+
+def _forgetPids(server, serverspath=None):
+    """Drops the recorded pids of a given server."""
+
+    _pids.pop(server, None)
+    if serverspath:
+        try:
+            os.remove(_pidfile(server, serverspath))
+        except OSError:
+            pass
+
+
+def _trackedProc(server, serverspath=None):
+    """Returns the Process recorded for a given server, if it is still
+    the same process, guarding against pid reuse via its creation time.
+    """
+
+    pids = _pids.get(server)
+    if pids is None and serverspath:
+        pids = _readPids(server, serverspath)
+    if pids is None:
+        return None
+    pid, ctime = pids
+    try:
+        process = psutil.Process(pid)
+        if abs(process.create_time() - ctime) < 0.01 and process.is_running():
+            _pids[server] = pids
+            return process
+    except psutil.Error:
+        pass
+    _pids.pop(server, None)
+    return None
+
+
+def isUp(server, serverspath=None):
     """Checks whether a server is up, by searching for its process.
 
     Returns a boolean indicating whether the server is up or not.
     """
-    for process in psutil.process_iter(attrs=['cmdline']):
-        if f'{server}.jar' in process.info['cmdline']:
-            return True
-    return False
+    return getProc(server, serverspath) is not None
 
 
-def termProc(server):
+def termProc(server, serverspath=None):
     """Finds the process for a given server and terminates it.
 
     Returns a boolean indicating whether the process was terminated.
     """
-    for process in psutil.process_iter(attrs=['cmdline']):
-        if f'{server}.jar' in process.info['cmdline']:
-            toKill = process.children()
-            toKill.append(process)
-            for p in toKill:
-                p.terminate()
-            gone, alive = psutil.wait_procs(toKill, timeout=3)
-            for p in alive:
-                p.kill()
-            gone, alive = psutil.wait_procs(toKill, timeout=3)
-            if not alive:
-                return True
-            else:
-                return False
-    return False
+    process = getProc(server, serverspath)
+    if process is None:
+        return False
+    toKill = process.children()
+    toKill.append(process)
+    for p in toKill:
+        p.terminate()
+    gone, alive = psutil.wait_procs(toKill, timeout=3)
+    for p in alive:
+        p.kill()
+    gone, alive = psutil.wait_procs(toKill, timeout=3)
+    invalidateProcIndex()
+    if not alive:
+        _forgetPids(server, serverspath)
+        return True
+    else:
+        return False
 
 
-def getProc(server):
-    """Finds and returns the Process object for a given server."""
+def getProc(server, serverspath=None):
+    """Finds and returns the Process object for a given server.
 
-    for process in psutil.process_iter(attrs=['cmdline']):
-        if f'{server}.jar' in process.info['cmdline']:
-            return process
+    Validates the recorded pid first and only falls back to
+    the process index if there is no valid record.
+    """
+
+    process = _trackedProc(server, serverspath)
+    if process:
+        return process
+    process = getProcIndex().get(server)
+    if process and process.is_running():
+        try:
+            _pids[server] = (process.pid, process.create_time())
+        except psutil.Error:
+            return None
+        return process
     return None
 
 
-async def sendCmd(loop, server, cmd):
-    """Passes a given command string to a server's screen."""
+async def waitForExit(process, loop):
+    """Waits for a given process to exit.
 
-    log.info(f'Sending \"{cmd}\" to {server}.')
+    Uses a pidfd registered with the event loop where the
+    platform supports it, so the exit is delivered by the kernel
+    the moment it happens; falls back to cheaply polling the process
+    from the loop otherwise, so no thread is tied up either way.
+    """
+    try:
+        fd = os.pidfd_open(process.pid)
+    except (AttributeError, OSError):
+        while process.is_running():
+            await asyncio.sleep(1, loop=loop)
+        return
+
+    exited = loop.create_future()
+
+    def _exited():
+        if not exited.done():
+            exited.set_result(None)
+
+    try:
+        # The pid may have been reused before the pidfd was opened.
+        if not process.is_running():
+            return
+        loop.add_reader(fd, _exited)
+        await exited
+    finally:
+        loop.remove_reader(fd)
+        os.close(fd)
+
+
+_stuffmax = 512
+
+
+def _batchCmds(cmds):
+    """Packs command strings into as few screen 'stuff' payloads as
+    possible, keeping each payload under screen's message size limit.
+    """
+
+    payload = ''
+    for cmd in cmds:
+        cmd = f'{cmd}\r'
+        if payload and len(payload) + len(cmd) > _stuffmax:
+            yield payload
+            payload = ''
+        payload += cmd
+    if payload:
+        yield payload
+
+
+async def _stuff(loop, server, payload):
     proc = await asyncio.create_subprocess_exec(
-        'screen', '-S', server, '-X', 'stuff', f'{cmd}\r',
+        'screen', '-S', server, '-X', 'stuff', payload,
         loop=loop
     )
     await proc.wait()
 
 
-async def sendCmds(loop, server, *cmds):
-    """Passes all given command strings to a server's screen."""
+async def _rconCmds(loop, server, servercfg, cmds):
+    """Runs commands via RCON, if configured for a given server.
+
+    Returns the list of responses of the commands RCON delivered, or
+    None if the server has no RCON configured. It stops short of the
+    first command RCON could not be used for, or right after one that
+    was sent but got no response, which is None; such a command may
+    have been run already, so it must not be sent again.
+    """
+
+    pool = getRconPool(server, servercfg, loop)
+    if pool is None:
+        return None
+    responses = []
+    for cmd in cmds:
+        try:
+            responses.append(await pool.command(cmd))
+        except rconNoResponse as e:
+            log.warning(f'RCON to {server} failed: {e.message}')
+            responses.append(None)
+            break
+        except (OSError, EOFError, asyncio.TimeoutError, rconException) as e:
+            log.warning(f'RCON to {server} unavailable, falling back to screen: {e!r}')
+            break
+    return responses
+
+
+async def sendCmd(loop, server, cmd, servercfg=None):
+    """Passes a given command string to a server's console.
+
+    Uses RCON if it is configured for the server, returning the
+    server's response, or None if it sent none; otherwise passes it
+    to the server's screen.
+    """
+
+    log.info(f'Sending \"{cmd}\" to {server}.')
+    if servercfg:
+        responses = await _rconCmds(loop, server, servercfg, (cmd,))
+        if responses:
+            return responses[0]
+    await _stuff(loop, server, f'{cmd}\r')
+
+
+async def sendCmds(loop, server, *cmds, servercfg=None):
+    """Passes all given command strings to a server's console.
+
+    Uses RCON if it is configured for the server, returning the
+    server's responses; otherwise, or from the first command RCON
+    could not be used for, commands are delivered to the server's screen in
+    batches, needing only a single screen invocation for the usual
+    handful of commands.
+    """
 
     for cmd in cmds:
         log.info(f'Sending \"{cmd}\" to {server}.')
-        proc = await asyncio.create_subprocess_exec(
-            'screen', '-S', server, '-X', 'stuff', f'{cmd}\r',
-            loop=loop
-        )
-        await proc.wait()
+    if servercfg:
+        responses = await _rconCmds(loop, server, servercfg, cmds)
+        if responses is not None and len(responses) == len(cmds):
+            return responses
+        cmds = cmds[len(responses or ()):]
+    for payload in _batchCmds(cmds):
+        await _stuff(loop, server, payload)
+
+
+async def sendCmdCapture(loop, server, cmd, servercfg, window=2.0):
+    """Passes a given command string to a server's console and
+    returns the server's response.
+
+    Servers using RCON respond directly, for all others the response
+    is captured from the lines written to their latest.log
+    following the command.
+    """
+
+    if getRconPool(server, servercfg, loop) is not None:
+        responses = await _rconCmds(loop, server, servercfg, (cmd,))
+        if responses:
+            if responses[0] is None:
+                return f'< No response from {server}! >'
+            return responses[0]
+    logpath = f'{servercfg["serverspath"]}/{server}/logs/latest.log'
+    _, lines = await captureOutput(
+        loop, logpath, sendCmd(loop, server, cmd), window=window
+    )
+    return '\n'.join(lines)
+
+
+async def fanout(loop, servers, func, limit=8):
+    """Runs a given coroutine function for each of the given servers
+    concurrently, with at most limit of them running at a time.
+
+    Returns the results in the same order as the servers.
+    """
+
+    slots = asyncio.Semaphore(limit, loop=loop)
+
+    async def run(server):
+        async with slots:
+            return await func(server)
+
+    return await asyncio.gather(*[run(s) for s in servers], loop=loop)
 
 
 async def exec_cmd(loop, ctx, *args):
@@ -91,23 +386,83 @@ async def exec_cmd(loop, ctx, *args):
         return stdout.decode().strip()
 
 
-async def serverStart(server, servercfg, loop):
-    """Start a given Minecraft server."""
+async def serverStart(server, servercfg, loop, timeout=None):
+    """Start a given Minecraft server.
 
-    cwd = os.getcwd()
-    os.chdir(servercfg['serverspath'] + f'/{server}')
-    proc = await asyncio.create_subprocess_exec(
-        'screen', '-h', '5000', '-dmS', server,
-        *(servercfg['servers'][server]['invocation']).split(), 'nogui',
-        loop=loop
-    )
-    await proc.wait()
-    os.chdir(cwd)
+    If a timeout is given, waits up to that many seconds for the
+    server to finish loading and returns the time it took in seconds,
+    or None if it did not get there.
+    """
+
+    logsub = None
+    if timeout is not None:
+        logsub = subscribeLog(servercfg['serverspath'] + f'/{server}/logs/latest.log', loop)
+    try:
+        started = monotonic()
+        proc = await asyncio.create_subprocess_exec(
+            'screen', '-h', '5000', '-dmS', server,
+            *(servercfg['servers'][server]['invocation']).split(), 'nogui',
+            cwd=servercfg['serverspath'] + f'/{server}',
+            loop=loop
+        )
+        await proc.wait()
+        invalidateProcIndex()
+        _forgetPids(server)
+        for _ in range(10):
+            found = await loop.run_in_executor(
+                None, _recordPids, server, servercfg['serverspath']
+            )
+            if found:
+                break
+            await asyncio.sleep(0.5, loop=loop)
+        else:
+            log.warning(f'Could not find the process for {server}, no pidfile written!')
+        if logsub is None:
+            return None
+        reported = await waitForReady(loop, logsub, timeout, _trackedProc(server))
+    finally:
+        if logsub:
+            logsub.close()
+    if reported is None:
+        log.warning(f'{server} did not finish loading within {timeout} seconds!')
+        return None
+    took = monotonic() - started
+    log.info(f'{server} is ready after {took:.1f}s, reporting {reported}s.')
+    return took
+
+
+async def waitForStop(server, loop, timeout, serverspath=None, proc=None):
+    """Waits for a given server's process to exit,
+    for at most timeout seconds.
+
+    Returns a boolean indicating whether the server has stopped.
+    """
+
+    if proc is None:
+        proc = await loop.run_in_executor(None, getProc, server, serverspath)
+        if proc is None:
+            return True
+    try:
+        await asyncio.wait_for(waitForExit(proc, loop), timeout, loop=loop)
+    except asyncio.TimeoutError:
+        return False
+    invalidateProcIndex()
+    return True
 
 
-async def serverStop(server, loop):
-    """Stop a given Minecraft server."""
+async def serverStop(server, loop, servercfg=None, timeout=None):
+    """Stop a given Minecraft server.
 
+    If a timeout is given, waits up to that many seconds for the
+    server to exit and returns the time it took in seconds,
+    or None if it is still running.
+    """
+
+    started = monotonic()
+    proc = None
+    if timeout is not None:
+        serverspath = servercfg['serverspath'] if servercfg else None
+        proc = await loop.run_in_executor(None, getProc, server, serverspath)
     await sendCmds(
         loop,
         server,
@@ -115,27 +470,34 @@ async def serverStop(server, loop):
         'title @a title {\"text\":\"STOPPING SERVER NOW\", \"bold\":true, \"italic\":true}',
         'broadcast Stopping now!',
         'save-all',
+        servercfg=servercfg
     )
     await asyncio.sleep(5, loop=loop)
     await sendCmd(
         loop,
         server,
-        'stop'
+        'stop',
+        servercfg=servercfg
     )
+    if timeout is None or proc is None:
+        return None
+    if await waitForStop(server, loop, timeout, proc=proc):
+        return monotonic() - started
+    return None
 
 
-async def serverTerminate(server, loop):
+async def serverTerminate(server, loop, serverspath=None):
     """Terminates a serverprocess forcefully.
 
     Returns a boolean indicating whether the process,
     was successfully terminated.
     """
-    _termProc = functools.partial(termProc, server)
+    _termProc = functools.partial(termProc, server, serverspath)
     killed = await loop.run_in_executor(None, _termProc)
     return killed
 
 
-async def serverStatus(servers, loop):
+async def serverStatus(servers, loop, serverspath=None):
     """Queries the status of one or all known Minecraft servers.
 
     Returns a list of status messages for all queried servers.
@@ -143,7 +505,7 @@ async def serverStatus(servers, loop):
     def getStatus():
         statuses = []
         for s in servers:
-            if isUp(s):
+            if isUp(s, serverspath):
                 log.info(f'{s} is running.')
                 statuses.append(f'# {s} is running.')
             else:
@@ -188,86 +550,224 @@ def buildCountdownSteps(cntd):
     return steps
 
 
+class CrashIndex:
+    """Index of a server's crash reports, newest first, keeping the
+    parsed fields of every report parsed so far.
+
+    The directory is only rescanned when its mtime changes, that is
+    when reports were added, removed or renamed; reports are known by
+    their name, mtime and size, and only new or changed ones get
+    stat'd or parsed again.
+    """
+
+    def __init__(self, reportspath):
+        self.reportspath = reportspath
+        self.stamp = None
+        self.entries = {}
+        self.order = []
+        self.lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            stamp = os.stat(self.reportspath).st_mtime_ns
+        except OSError:
+            stamp = None
+        if stamp == self.stamp and stamp is not None:
+            return
+        self.stamp = stamp
+        entries = {}
+        if stamp is not None:
+            with os.scandir(self.reportspath) as it:
+                for e in it:
+                    try:
+                        st = e.stat()
+                    except OSError:
+                        continue
+                    key = (st.st_mtime, st.st_size)
+                    old = self.entries.get(e.name)
+                    entries[e.name] = old if old and old[0] == key else [key, None]
+        self.entries = entries
+        self.order = sorted(entries, key=lambda n: entries[n][0][0], reverse=True)
+
+    def _entry(self, name):
+        """Returns the entry for a report, making sure it is current,
+        as a report may still have been written to when first seen.
+        """
+
+        st = os.stat(f'{self.reportspath}/{name}')
+        key = (st.st_mtime, st.st_size)
+        entry = self.entries.get(name)
+        if entry is None or entry[0] != key:
+            entry = self.entries[name] = [key, None]
+        return entry
+
+    def nth(self, nthlast=0):
+        """Returns the path and mtime of the nth latest report,
+        raises IndexError if there is none.
+        """
+
+        with self.lock:
+            self._refresh()
+            name = self.order[nthlast]
+            try:
+                entry = self._entry(name)
+            except OSError:
+                raise IndexError(nthlast)
+            return f'{self.reportspath}/{name}', entry[0][0]
+
+    def reports(self):
+        """Returns the paths and mtimes of all reports, newest first."""
+
+        with self.lock:
+            self._refresh()
+            return [(f'{self.reportspath}/{name}', self.entries[name][0][0])
+                    for name in self.order]
+
+    def parsed(self, rpath):
+        """Returns the parsed fields of a report, parsing it only
+        if it has not been parsed before, or changed since.
+        """
+
+        name = os.path.basename(rpath)
+        with self.lock:
+            entry = self._entry(name)
+            if entry[1] is None:
+                entry[1] = _parsereport(rpath)
+            return entry[1]
+
+
+_crashindexes = {}
+_crashindexeslock = threading.Lock()
+
+
+def getCrashIndex(reportspath):
+    """Returns the shared CrashIndex for a crash-reports directory."""
+
+    with _crashindexeslock:
+        if reportspath not in _crashindexes:
+            _crashindexes[reportspath] = CrashIndex(reportspath)
+        return _crashindexes[reportspath]
+
+
 def getcrashreport(server, serverspath, nthlast: int=0):
     """Retrieves the filename of the nth latest crashreport
     for a given server, in addition to the date of last modification.
     """
 
-    rpath = sorted(
-        glob.iglob(serverspath + f'/{server}/crash-reports/*'),
-        key=os.path.getmtime,
-        reverse=True
-    )[nthlast]
-    return rpath, os.path.getmtime(rpath)
+    return getCrashIndex(serverspath + f'/{server}/crash-reports').nth(nthlast)
 
 
 def parsereport(rpath):
     """Retrieves and parses a crashreport given its path.
-    Returns a list containing crashreport flavor text,
-    time, description, short stacktrace and affected level
-    section, if available, in a ready to print format.
+    Returns crashreport time, description, short stacktrace and
+    flavor text, followed by the block entity, affected level,
+    Sponge PhaseTracker and thread dump sections, if available,
+    in a ready to print format.
+
+    The report is memory mapped and searched without being read in
+    as a whole; each section is capped at 20 lines and everything
+    read at 32 KiB, so even runaway reports are parsed quickly.
+    Parsed reports are cached by their crash report index.
     """
 
-    with open(rpath, 'r') as r:
-        # Discard until flavortext is found.
-        while True:
-            l = r.readline()
-            if not l:
-                break
-            if l.startswith('// '):
-                flavor = l
-                break
-        # Read in Time and Description lines.
-        r.readline()
-        crashtime = r.readline()
-        desc = r.readline()
-        r.readline()
-        # Read in short stacktrace.
-        strace = []
-        while True:
-            l = r.readline()
-            if not l or l == '\n':
-                break
-            strace.append(l)
-        # Look for relevant sections in remaining report.
-        block = []
-        level = []
-        phase = []
-        while True:
-            l = r.readline()
-            if not l:
+    return getCrashIndex(os.path.dirname(rpath)).parsed(rpath)
+
+
+_reportbytes = 32 << 10
+_sectionlines = 20
+_stracelines = 32
+_linebytes = 512
+
+_reportsections = (
+    # Header, title, lines to skip after the header, lines ending the section.
+    (b'-- Affected', '# Affected level:\n', 0, ()),
+    (b'-- Block', '# Block entity being ticked:\n', 0, (b'Stacktrace:',)),
+    (b'-- Sponge', '# Sponge PhaseTracker:\n', 1, (b'/***', b'Stacktrace:')),
+    (b'-- Thread Dump', '# Thread dump:\n', 1, ()),
+)
+
+
+def _skipline(mm, pos, end):
+    nl = mm.find(b'\n', pos, end)
+    return end if nl < 0 else nl + 1
+
+
+def _reportlines(mm, pos, end, maxlines, budget, stop=()):
+    """Reads lines from a mapped report, starting at pos, until a blank
+    line, a line starting with one of stop, end, maxlines or the byte
+    budget is reached; overlong lines are cut short.
+
+    Returns the decoded lines and the position after them.
+    """
+
+    lines = []
+    while pos < end and len(lines) < maxlines:
+        nl = mm.find(b'\n', pos, min(end, pos + _linebytes))
+        nxt = pos + _linebytes if nl < 0 else nl + 1
+        raw = mm[pos:min(nxt, end)]
+        if not raw.strip() or raw.startswith(stop):
+            break
+        line = raw.rstrip(b'\r\n').decode('utf-8', errors='replace') + '\n'
+        if len(line) > budget:
+            break
+        budget -= len(line)
+        lines.append(line)
+        if nl < 0:
+            # Skip the rest of an overlong line.
+            nl = mm.find(b'\n', nxt, end)
+            nxt = end if nl < 0 else nl + 1
+        pos = nxt
+    return lines, pos
+
+
+def _parsereport(rpath):
+    crashtime = desc = flavor = ''
+    strace = []
+    sections = [[] for _ in _reportsections]
+    with open(rpath, 'rb') as r:
+        try:
+            mm = mmap.mmap(r.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty report.
+            return (crashtime, desc, strace, flavor, *sections)
+    with mm:
+        end = len(mm)
+        budget = _reportbytes
+        # Skip ahead to the flavortext.
+        pos = 0 if mm[:3] == b'// ' else mm.find(b'\n// ', 0, end) + 1
+        if pos or mm[:3] == b'// ':
+            head, pos = _reportlines(mm, pos, end, 1, budget)
+            flavor = head[0] if head else ''
+            # Read in Time and Description lines.
+            head, pos = _reportlines(mm, _skipline(mm, pos, end), end, 2, budget)
+            crashtime, desc = (head + ['', ''])[:2]
+            # Read in short stacktrace.
+            strace, pos = _reportlines(mm, _skipline(mm, pos, end), end, _stracelines, budget)
+            budget -= sum(len(l) for l in strace)
+        # Look for relevant sections in remaining report, from its end,
+        # as they follow the stacktraces making up the bulk of big ones;
+        # in a single pass, so reports without them are searched once.
+        starts = {}
+        hdr = end
+        while len(starts) < len(_reportsections):
+            hdr = mm.rfind(b'\n-- ', pos, hdr)
+            if hdr < 0:
                 break
-            if l.startswith('-- Block'):
-                block.append('# Block entity being ticked:\n')
-                while True:
-                    l = r.readline()
-                    if not l or l == '\n' or l == 'Stacktrace:\n':
-                        break
-                    block.append(l)
-            if l.startswith('-- Affected'):
-                level.append('# Affected level:\n')
-                while True:
-                    l = r.readline()
-                    if not l or l == '\n':
-                        break
-                    level.append(l)
-            if l.startswith('-- Sponge'):
-                r.readline()
-                l = r.readline()
-                if l == '\n':
-                    break
-                phase.append('# Sponge PhaseTracker:\n')
-                spongecounter = 20  # Workaround for when the PhaseTracker flips out.
-                while spongecounter > 0:
-                    spongecounter -= 1
-                    l = r.readline()
-                    if not l or l == '\n' or l.startswith('/***') or l.startswith('Stacktrace:'):
-                        break
-                    phase.append(l)
-                if len(phase) <= 1:
-                    phase = []
-
-    return crashtime, desc, strace, flavor, level, block, phase
+            for i, (header, *_) in enumerate(_reportsections):
+                if i not in starts and mm[hdr + 1:hdr + 1 + len(header)] == header:
+                    starts[i] = hdr + 1
+        for i, (header, title, skip, stop) in enumerate(_reportsections):
+            start = starts.get(i)
+            if start is None:
+                continue
+            for _ in range(skip + 1):
+                start = _skipline(mm, start, end)
+            lines, _ = _reportlines(mm, start, end, _sectionlines, budget, stop)
+            if lines:
+                budget -= sum(len(l) for l in lines)
+                sections[i] = [title, *lines]
+
+    return (crashtime, desc, strace, flavor, *sections)
 
 
 def formatreport(rpath, crashtime, desc, flavor, strace, *sections):
@@ -0,0 +1,148 @@
+import psutil
+import asyncio
+import logging
+from array import array
+from math import ceil
+from .mcservutils import getProc
+
+log = logging.getLogger('charfred')
+
+metrics = ('cpu', 'rss', 'threads', 'fds')
+
+
+class RingBuffer:
+    """Fixed size, array-backed buffer of floats,
+    overwriting its oldest values once full.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = array('d', bytes(8 * capacity))
+        self.head = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, value):
+        self.data[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    def values(self, last=None):
+        """Returns the most recent values, oldest first."""
+
+        n = self.size if last is None else min(last, self.size)
+        start = (self.head - n) % self.capacity
+        if start + n <= self.capacity:
+            return self.data[start:start + n]
+        return self.data[start:] + self.data[:(start + n) % self.capacity]
+
+    def latest(self):
+        if not self.size:
+            return None
+        return self.data[self.head - 1]
+
+
+def summarize(values):
+    """Returns min, avg, max and 95th percentile of given values."""
+
+    if not values:
+        return None
+    ordered = sorted(values)
+    p95 = ordered[max(0, ceil(0.95 * len(ordered)) - 1)]
+    return ordered[0], sum(ordered) / len(ordered), ordered[-1], p95
+
+
+class ResourceSampler:
+    """Periodically samples cpu, rss, thread and file descriptor counts
+    of all configured servers' processes into per server ring buffers.
+    """
+
+    def __init__(self, servercfg, loop, interval=10, window=3600):
+        self.servercfg = servercfg
+        self.loop = loop
+        self.interval = interval
+        self.capacity = max(1, window // interval)
+        self.history = {}
+        self.procs = {}
+        self.task = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = self.loop.create_task(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    def _buffers(self, server):
+        if server not in self.history:
+            self.history[server] = {m: RingBuffer(self.capacity) for m in metrics}
+        return self.history[server]
+
+    def _proc(self, server):
+        """Returns a Process for a given server, reusing the previous
+        one as long as it is still the same process, since cpu usage is
+        measured between calls on the same Process object.
+        """
+
+        proc = self.procs.get(server)
+        if proc and proc.is_running():
+            return proc
+        proc = getProc(server, self.servercfg['serverspath'])
+        if proc is None:
+            self.procs.pop(server, None)
+            return None
+        # The first call only primes the cpu measurement, skip this round.
+        proc.cpu_percent(None)
+        self.procs[server] = proc
+        return None
+
+    def sample(self):
+        """Takes one sample of every running server."""
+
+        for server in list(self.servercfg['servers']):
+            try:
+                proc = self._proc(server)
+                if proc is None:
+                    continue
+                with proc.oneshot():
+                    values = (
+                        proc.cpu_percent(None),
+                        proc.memory_info().rss,
+                        proc.num_threads(),
+                        proc.num_fds()
+                    )
+            except psutil.Error:
+                self.procs.pop(server, None)
+                continue
+            buffers = self._buffers(server)
+            for m, v in zip(metrics, values):
+                buffers[m].append(v)
+
+    async def _run(self):
+        log.info('RS: Resource sampler started.')
+        try:
+            while True:
+                await self.loop.run_in_executor(None, self.sample)
+                await asyncio.sleep(self.interval, loop=self.loop)
+        finally:
+            log.info('RS: Resource sampler stopped.')
+
+    def stats(self, server, window=3600):
+        """Returns a dict mapping each metric to its current value and
+        min, avg, max and p95 over the given window in seconds.
+        """
+
+        if server not in self.history:
+            return None
+        last = max(1, window // self.interval)
+        stats = {}
+        for m, buffer in self.history[server].items():
+            summary = summarize(buffer.values(last))
+            if summary is None:
+                return None
+            stats[m] = (buffer.latest(), *summary)
+        return stats
@@ -0,0 +1,89 @@
+import asyncio
+from collections import deque
+from time import monotonic
+
+
+class OutputBatcher:
+    """Packs lines into as few messages as possible and sends them
+    with a given send coroutine function, without ever falling behind.
+
+    At most maxlines lines are buffered, once full the oldest lines are
+    dropped and reported with a skipped marker in the next message.
+    Sends are spaced at least interval seconds apart; Discord holds back
+    rate limited sends, so slow sends double the interval, up to
+    maxinterval, and fast ones shrink it again.
+    """
+
+    def __init__(self, send, loop, maxlines=64, limit=1900, interval=1.0, maxinterval=16.0):
+        self.send = send
+        self.loop = loop
+        self.maxlines = maxlines
+        self.limit = limit
+        self.mininterval = interval
+        self.interval = interval
+        self.maxinterval = maxinterval
+        self.lines = deque()
+        self.skipped = 0
+        self.wake = asyncio.Event(loop=loop)
+        self.closing = asyncio.Event(loop=loop)
+        self.task = loop.create_task(self._run())
+
+    def put(self, line):
+        if len(self.lines) >= self.maxlines:
+            self.lines.popleft()
+            self.skipped += 1
+        self.lines.append(line)
+        self.wake.set()
+
+    def skip(self, count):
+        """Counts lines dropped before they reached the batcher."""
+
+        if count:
+            self.skipped += count
+            self.wake.set()
+
+    def _pack(self):
+        parts = []
+        size = 0
+        if self.skipped:
+            parts.append(f'< {self.skipped} lines skipped! >')
+            size = len(parts[0])
+            self.skipped = 0
+        while self.lines:
+            line = self.lines[0][:self.limit]
+            if parts and size + len(line) + 1 > self.limit:
+                break
+            self.lines.popleft()
+            parts.append(line)
+            size += len(line) + 1
+        return '\n'.join(parts)
+
+    async def _run(self):
+        while True:
+            if not self.lines and not self.skipped:
+                if self.closing.is_set():
+                    return
+                self.wake.clear()
+                await self.wake.wait()
+                continue
+            sent = monotonic()
+            await self.send(self._pack())
+            latency = monotonic() - sent
+            if latency > 1:
+                self.interval = min(self.maxinterval, self.interval * 2)
+            else:
+                self.interval = max(self.mininterval, self.interval * 0.75)
+            if self.closing.is_set():
+                continue
+            try:
+                await asyncio.wait_for(self.closing.wait(), max(0, self.interval - latency),
+                                       loop=self.loop)
+            except asyncio.TimeoutError:
+                pass
+
+    async def close(self):
+        """Sends what is left and waits for it to be sent."""
+
+        self.closing.set()
+        self.wake.set()
+        await self.task
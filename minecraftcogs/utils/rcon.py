@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import re
+import struct
+
+log = logging.getLogger('charfred')
+
+LOGIN = 3
+COMMAND = 2
+RESPONSE = 0
+
+_colorcodes = re.compile('§.')
+
+
+class rconException(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+class rconNoResponse(rconException):
+    """Raised when a command was sent, but no response came back,
+    so it may or may not have been run.
+    """
+
+
+def _pack(reqid, kind, payload):
+    payload = payload.encode('utf-8') + b'\x00\x00'
+    return struct.pack('<iii', len(payload) + 8, reqid, kind) + payload
+
+
+class RconConnection:
+    """A single authenticated RCON connection to a Minecraft server."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.reqid = 0
+
+    @classmethod
+    async def connect(cls, host, port, password, loop, timeout=5):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, loop=loop), timeout, loop=loop
+        )
+        self = cls(reader, writer)
+        try:
+            reqid, _, _ = await asyncio.wait_for(
+                self._request(LOGIN, password), timeout, loop=loop
+            )
+        except Exception:
+            self.close()
+            raise
+        if reqid == -1:
+            self.close()
+            raise rconException(f'RCON login to {host}:{port} failed, wrong password!')
+        return self
+
+    async def _read(self):
+        header = await self.reader.readexactly(4)
+        length, = struct.unpack('<i', header)
+        data = await self.reader.readexactly(length)
+        reqid, kind = struct.unpack('<ii', data[:8])
+        return reqid, kind, data[8:-2].decode('utf-8', errors='replace')
+
+    async def _request(self, kind, payload):
+        self.reqid += 1
+        self.writer.write(_pack(self.reqid, kind, payload))
+        await self.writer.drain()
+        return await self._read()
+
+    async def command(self, cmd):
+        """Runs a console command and returns the server's response."""
+
+        self.reqid += 2
+        reqid, endid = self.reqid - 1, self.reqid
+        # Responses longer than one packet are split into several, the
+        # reply to a trailing empty packet marks the end of the response.
+        self.writer.write(_pack(reqid, COMMAND, cmd) + _pack(endid, RESPONSE, ''))
+        await self.writer.drain()
+        fragments = []
+        while True:
+            rid, _, response = await self._read()
+            if rid == endid:
+                break
+            if rid == reqid:
+                fragments.append(response)
+        return _colorcodes.sub('', ''.join(fragments))
+
+    def alive(self):
+        return not self.reader.at_eof() and not self.writer.transport.is_closing()
+
+    def close(self):
+        self.writer.close()
+
+
+class RconPool:
+    """Pool of persistent RCON connections to one server,
+    transparently replacing connections closed while idle.
+    """
+
+    def __init__(self, host, port, password, loop, size=2, timeout=10):
+        self.settings = (host, port, password)
+        self.loop = loop
+        self.timeout = timeout
+        self.idle = []
+        self.slots = asyncio.Semaphore(size, loop=loop)
+
+    async def _connect(self):
+        return await RconConnection.connect(*self.settings, self.loop)
+
+    async def _conn(self):
+        while self.idle:
+            conn = self.idle.pop()
+            if conn.alive():
+                return conn
+            # Closed by the server while idle, most likely it restarted.
+            conn.close()
+        return await self._connect()
+
+    async def command(self, cmd):
+        """Runs a console command on one of the pooled connections.
+
+        Connection and login failures are raised as they are, before
+        the command was sent. Once it was sent, it is never sent again;
+        if the server does not respond within timeout seconds, e.g.
+        because it is frozen, rconNoResponse is raised.
+        """
+
+        async with self.slots:
+            conn = await self._conn()
+            try:
+                response = await asyncio.wait_for(conn.command(cmd), self.timeout, loop=self.loop)
+            except (OSError, EOFError, asyncio.TimeoutError) as e:
+                # A half read response leaves the connection unusable.
+                conn.close()
+                raise rconNoResponse(f'No response to \"{cmd}\": {e!r}')
+            except BaseException:
+                conn.close()
+                raise
+            self.idle.append(conn)
+            return response
+
+    def close(self):
+        for conn in self.idle:
+            conn.close()
+        self.idle = []
+
+
+_pools = {}
+
+
+def getRconPool(server, servercfg, loop):
+    """Returns the RCON connection pool for a given server,
+    or None if the server has no RCON port configured.
+    """
+
+    cfg = servercfg['servers'].get(server, {})
+    if 'rconport' not in cfg:
+        return None
+    settings = (cfg.get('rconhost', 'localhost'), int(cfg['rconport']), cfg.get('rconpassword', ''))
+    pool = _pools.get(server)
+    if pool and pool.settings != settings:
+        pool.close()
+        pool = None
+    if pool is None:
+        pool = _pools[server] = RconPool(*settings, loop)
+    return pool
+
+
+def closeRconPools():
+    for pool in _pools.values():
+        pool.close()
+    _pools.clear()
@@ -0,0 +1,247 @@
+import gzip
+import hashlib
+import logging
+import os
+from datetime import date, datetime, timedelta
+from time import time
+from .logevents import parseLine, Join, Leave
+from .logstore import LogStore, logentry, scanlog, startday
+
+log = logging.getLogger('charfred')
+
+_fingerprintsize = 512
+_pendingtime = 3600
+
+
+def _fingerprint(data):
+    return hashlib.sha1(data[:_fingerprintsize]).hexdigest()
+
+
+class PlaytimeStore(LogStore):
+    """Persistent, incrementally updated player session aggregates of
+    a server, derived from the join and leave lines of its logs.
+
+    Per log file the offset processed so far is kept, so no byte is
+    read twice; when latest.log gets archived, the archive is recognized
+    by the fingerprint of its beginning and continued from where
+    latest.log was left off. Between latest.log being renamed and its
+    archive being written, its entry is kept pending, for at most
+    _pendingtime seconds.
+
+    Playtime is aggregated per player and day, and per day and hour
+    into player-seconds, which is all the queries need. The store is
+    kept next to the logs in .playtime.json.
+    """
+
+    filename = '.playtime.json'
+    tag = 'PT'
+
+    def _load(self):
+        super()._load()
+        for key in ('players', 'hours', 'seen', 'pending'):
+            self.data.setdefault(key, {})
+
+    def _when(self, entry, rel):
+        return datetime.fromordinal(entry['day0']) + timedelta(seconds=rel)
+
+    def _credit(self, player, start, end):
+        """Adds a session, given as datetimes, to the aggregates."""
+
+        players = self.data['players'].setdefault(player, {})
+        hours = self.data['hours']
+        while start < end:
+            nexthour = start.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+            secs = int((min(nexthour, end) - start).total_seconds())
+            day = str(start.toordinal())
+            players[day] = players.get(day, 0) + secs
+            hours.setdefault(day, [0] * 24)[start.hour] += secs
+            start = nexthour
+        seen = end.timestamp()
+        if seen > self.data['seen'].get(player, 0):
+            self.data['seen'][player] = seen
+
+    def _creditAll(self, entry, sessions):
+        for player, start, end in sessions:
+            self._credit(player, self._when(entry, start), self._when(entry, end))
+
+    def _close(self, entry):
+        """Ends all open sessions of a file at the last time logged in it."""
+
+        end = entry['days'] * 86400 + entry['last']
+        self._creditAll(entry, [(player, rel, end) for player, rel in entry['open'].items()])
+        entry['open'] = {}
+
+    def _scan(self, f, entry):
+        """Reads the join and leave lines from f, starting at the entry's
+        scanned offset, and returns the sessions they ended.
+        """
+
+        ended = []
+        for _, rel, line in scanlog(f, entry):
+            if b' the game' not in line:
+                continue
+            event = parseLine(line.decode('utf-8', errors='replace').rstrip('\r'))
+            if isinstance(event, Join):
+                entry['open'].setdefault(event.player, rel)
+            elif isinstance(event, Leave) and event.player in entry['open']:
+                ended.append((event.player, entry['open'].pop(event.player), rel))
+        return ended
+
+    def _newentry(self, ident, day0):
+        return logentry(ident, day0, fingerprint=None, open={})
+
+    def _updateArchive(self, name, day):
+        path = f'{self.logspath}/{name}'
+        files = self.data['files']
+        if name in files:
+            return False
+        pending = self.data['pending']
+        try:
+            with gzip.open(path, 'rb') as f:
+                head = f.read(_fingerprintsize)
+                origin = None
+                for store in (pending, files):
+                    for other, candidate in store.items():
+                        fp = candidate['fingerprint']
+                        if fp and 64 <= fp[1] <= len(head) and _fingerprint(head[:fp[1]]) == fp[0]:
+                            # The archived latest.log, continue where it was left off.
+                            origin = (store, other)
+                            break
+                    if origin:
+                        break
+                if origin is None:
+                    entry = self._newentry(None, day.toordinal())
+                else:
+                    candidate = origin[0][origin[1]]
+                    entry = dict(candidate, open=dict(candidate['open']))
+                f.seek(entry['scanned'])
+                ended = self._scan(f, entry)
+        except (OSError, EOFError) as e:
+            # Possibly still being written, tried again on the next update.
+            log.warning(f'PT: Could not read {path}: {e}')
+            return False
+        if origin:
+            del origin[0][origin[1]]
+        self._creditAll(entry, ended)
+        entry.pop('pendingsince', None)
+        entry['ident'] = None
+        entry['fingerprint'] = None
+        self._close(entry)
+        files[name] = entry
+        return True
+
+    def _updateLatest(self):
+        path = f'{self.logspath}/latest.log'
+        files = self.data['files']
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return False
+        with f:
+            st = os.fstat(f.fileno())
+            entry = files.get('latest.log')
+            if entry is None or entry['ident'] != st.st_ino or st.st_size < entry['scanned']:
+                if entry is not None and entry['ident'] != st.st_ino:
+                    # Rotated, kept until its archive turns up.
+                    entry['pendingsince'] = time()
+                    self.data['pending'][str(entry['ident'])] = entry
+                elif entry is not None:
+                    # Truncated.
+                    self._close(entry)
+                entry = self._newentry(st.st_ino, None)
+            elif st.st_size == entry['scanned']:
+                return False
+            if entry['fingerprint'] is None or entry['fingerprint'][1] < _fingerprintsize:
+                head = f.read(_fingerprintsize)
+                entry['fingerprint'] = [_fingerprint(head), len(head)]
+            f.seek(entry['scanned'])
+            ended = self._scan(f, entry)
+        startday(entry, st.st_mtime)
+        self._creditAll(entry, ended)
+        files['latest.log'] = entry
+        return True
+
+    def _update(self, running=True):
+        changed = super()._update()
+        pending = self.data['pending']
+        for ident, entry in list(pending.items()):
+            if time() - entry['pendingsince'] > _pendingtime:
+                # Rotated away without being archived.
+                self._close(entry)
+                del pending[ident]
+                changed = True
+        entry = self.data['files'].get('latest.log')
+        if not running and entry and entry['open']:
+            # A crashed server logs no leave lines,
+            # its players were last seen when it last logged.
+            self._close(entry)
+            changed = True
+        return changed
+
+    def online(self):
+        """Returns the players in the middle of a session, mapped to
+        the timestamp their session began.
+
+        Only current as of the last update, which must be told whether
+        the server is running, so sessions cut short by a crash end.
+        """
+
+        entry = (self.data or {}).get('files', {}).get('latest.log')
+        if not entry or entry['day0'] is None:
+            return {}
+        return {p: self._when(entry, rel).timestamp() for p, rel in entry['open'].items()}
+
+    def playtime(self, player, days=None):
+        """Returns a player's total playtime in seconds,
+        over the last given number of days or all time.
+        """
+
+        daily = (self.data or {}).get('players', {}).get(player, {})
+        since = date.today().toordinal() - days if days else 0
+        total = sum(secs for day, secs in daily.items() if int(day) > since)
+        started = self.online().get(player)
+        if started:
+            total += max(0, time() - started)
+        return total
+
+    def lastseen(self, player):
+        if player in self.online():
+            return time()
+        return (self.data or {}).get('seen', {}).get(player)
+
+    def top(self, days=30, count=10):
+        """Returns the players with the most playtime over the last
+        given number of days, as a list of player and seconds.
+        """
+
+        since = date.today().toordinal() - days
+        totals = {}
+        for player, daily in (self.data or {}).get('players', {}).items():
+            total = sum(secs for day, secs in daily.items() if int(day) > since)
+            if total:
+                totals[player] = total
+        return sorted(totals.items(), key=lambda t: t[1], reverse=True)[:count]
+
+    def hours(self, days=30):
+        """Returns the average number of concurrent players for each
+        hour of the day, over the last given number of days.
+        """
+
+        since = date.today().toordinal() - days
+        totals = [0] * 24
+        for day, hours in (self.data or {}).get('hours', {}).items():
+            if int(day) > since:
+                for h, secs in enumerate(hours):
+                    totals[h] += secs
+        return [secs / (3600 * days) for secs in totals]
+
+
+_stores = {}
+
+
+def getPlaytimeStore(logspath):
+    """Returns the shared PlaytimeStore for a given logs directory."""
+
+    if logspath not in _stores:
+        _stores[logspath] = PlaytimeStore(logspath)
+    return _stores[logspath]
@@ -0,0 +1,87 @@
+"""Benchmarks the crash report parser against budgets on the synthetic
+reports of gencrashreports, each parsed in a fresh interpreter.
+
+Reports with sections must parse within timebudget, reports without
+any within baretimebudget, as the headers are then searched for
+through the whole report; neither may allocate more than heapbudget
+on the Python heap. Exits non-zero if a budget is missed.
+
+    python tests/bench_crashreports.py [DIR]
+
+Without DIR the reports are generated into a temporary directory.
+"""
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+sys.path.insert(0, here)
+
+timebudget = 1.0
+baretimebudget = 2.0
+heapbudget = 1 << 20
+
+
+def measure(path):
+    from minecraftcogs.utils.mcservutils import _parsereport
+
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    t = time.perf_counter()
+    parsed = _parsereport(path)
+    secs = time.perf_counter() - t
+    _, peak = tracemalloc.get_traced_memory()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base
+    crashtime, desc, strace, flavor, *sections = parsed
+    return {
+        'secs': secs, 'heap': peak, 'rss': rss << 10,
+        'desc': desc, 'strace': len(strace), 'sections': [len(s) for s in sections]
+    }
+
+
+def bench(reports):
+    failed = False
+    for path, withsections in reports:
+        out = subprocess.run([sys.executable, __file__, '--measure', path],
+                             check=True, stdout=subprocess.PIPE).stdout
+        m = json.loads(out)
+        limit = timebudget if withsections else baretimebudget
+        misses = []
+        if m['secs'] > limit:
+            misses.append(f'time over {limit}s')
+        if m['heap'] > heapbudget:
+            misses.append(f'heap over {heapbudget >> 10} KiB')
+        if not m['desc'].startswith('Description:'):
+            misses.append('no description')
+        if all(m['sections']) != withsections or any(m['sections']) != withsections:
+            misses.append(f'sections {m["sections"]}')
+        failed |= bool(misses)
+        print(f'{os.path.basename(path)}: {os.path.getsize(path) >> 20} MiB, '
+              f'{m["secs"]:.3f}s, heap peak {m["heap"] >> 10} KiB, maxrss +{m["rss"] >> 20} MiB, '
+              f'strace {m["strace"]} lines, sections {m["sections"]}'
+              + (' -- ' + ', '.join(misses) if misses else ''))
+    return failed
+
+
+def main(args):
+    from gencrashreports import gencorpus
+
+    if args:
+        os.makedirs(args[0], exist_ok=True)
+        return bench(gencorpus(args[0]))
+    with tempfile.TemporaryDirectory() as tmp:
+        return bench(gencorpus(tmp))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--measure']:
+        print(json.dumps(measure(sys.argv[2])))
+    else:
+        sys.exit(1 if main(sys.argv[1:]) else 0)
@@ -0,0 +1,78 @@
+"""Counts the screen invocations of a restart countdown, before and
+after sendCmds batched its commands into a single 'stuff' payload.
+
+Replays the commands the restart command sends at each step of the
+default 10 minute countdown against a server without RCON, with
+screen replaced by a recorder. Before, every command spawned its own
+screen; exits non-zero unless every step now takes a single spawn and
+the server's console receives the same input as before.
+
+    python tests/bench_screenspawns.py
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from minecraftcogs.utils import mcservutils
+from minecraftcogs.utils.mcservutils import buildCountdownSteps, sendCmds
+
+countdownSteps = ["20m", "15m", "10m", "5m", "3m",
+                  "2m", "1m", "30s", "10s", "5s"]
+
+
+def stepCmds(step):
+    """The commands announcing a countdown step, as sent by restart."""
+
+    return (
+        'title @a times 20 40 20',
+        f'title @a subtitle {{\"text\":\"in {step[0]} {step[2]}!\",\"italic\":true}}',
+        'title @a title {\"text\":\"Restarting\", \"bold\":true}',
+        f'broadcast Restarting in {step[0]} {step[2]}!'
+    )
+
+
+async def sendCmdsBefore(loop, server, *cmds):
+    """sendCmds as it was, one screen invocation per command."""
+
+    for cmd in cmds:
+        await mcservutils._stuff(loop, server, f'{cmd}\r')
+
+
+async def countdown(loop, send):
+    for step in buildCountdownSteps(countdownSteps[2:]):
+        await send(loop, 'survival', *stepCmds(step))
+
+
+def count(send):
+    stuffed = []
+
+    async def stuff(loop, server, payload):
+        stuffed.append(payload)
+
+    loop = asyncio.new_event_loop()
+    mcservutils._stuff, original = stuff, mcservutils._stuff
+    try:
+        loop.run_until_complete(countdown(loop, send))
+    finally:
+        mcservutils._stuff = original
+        loop.close()
+    return stuffed
+
+
+def main():
+    steps = len(buildCountdownSteps(countdownSteps[2:]))
+    before = count(sendCmdsBefore)
+    after = count(sendCmds)
+    print(f'Default countdown, {steps} steps: {len(before)} screen spawns before, '
+          f'{len(after)} after, per server.')
+    if ''.join(before) != ''.join(after):
+        print('Console input differs!')
+        return 1
+    return 0 if len(after) == steps else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
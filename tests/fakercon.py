@@ -0,0 +1,82 @@
+import asyncio
+import struct
+
+LOGIN = 3
+COMMAND = 2
+RESPONSE = 0
+
+fragment = 4096
+
+
+def _pack(reqid, kind, payload):
+    payload = payload.encode('utf-8') + b'\x00\x00'
+    return struct.pack('<iii', len(payload) + 8, reqid, kind) + payload
+
+
+class FakeRcon:
+    """Local RCON server behaving like a Minecraft server's.
+
+    Responses come from the responses dict, or echo the command;
+    long ones are split into fragment sized packets, and packets of
+    an unknown type are answered with the same id, as Minecraft does.
+    Commands listed in delays are answered only after that many
+    seconds; every command run is recorded in ran.
+    """
+
+    def __init__(self, loop, password='secret'):
+        self.loop = loop
+        self.password = password
+        self.responses = {}
+        self.delays = {}
+        self.ran = []
+        self.logins = 0
+        self.writers = []
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, '127.0.0.1', 0, loop=self.loop)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    def drop(self):
+        """Closes all client connections, as a restarting server would."""
+
+        for writer in self.writers:
+            writer.close()
+        self.writers = []
+
+    async def stop(self):
+        self.drop()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self.writers.append(writer)
+        authed = False
+        try:
+            while True:
+                length, = struct.unpack('<i', await reader.readexactly(4))
+                data = await reader.readexactly(length)
+                reqid, kind = struct.unpack('<ii', data[:8])
+                payload = data[8:-2].decode('utf-8')
+                if kind == LOGIN:
+                    self.logins += 1
+                    authed = payload == self.password
+                    writer.write(_pack(reqid if authed else -1, COMMAND, ''))
+                elif not authed:
+                    writer.write(_pack(-1, RESPONSE, ''))
+                elif kind == COMMAND:
+                    self.ran.append(payload)
+                    if payload in self.delays:
+                        await asyncio.sleep(self.delays[payload], loop=self.loop)
+                    response = self.responses.get(payload, payload)
+                    for i in range(0, max(1, len(response)), fragment):
+                        writer.write(_pack(reqid, RESPONSE, response[i:i + fragment]))
+                else:
+                    writer.write(_pack(reqid, RESPONSE, f'Unknown request {kind:x}'))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,106 @@
+"""Writes synthetic Minecraft crash reports for benchmarking the parser.
+
+Reports are padded to the given size with a runaway stacktrace between
+the head and the sections, as in the big reports of recursing servers.
+
+    python tests/gencrashreports.py DIR
+"""
+
+import os
+import sys
+
+head = """---- Minecraft Crash Report ----
+// Ooh. Shiny.
+
+Time: 18.10.26 12:00
+Description: Ticking block entity
+
+java.lang.StackOverflowError: Ticking block entity
+\tat net.minecraft.Recursive.call(Recursive.java:42)
+\tat net.minecraft.Recursive.call(Recursive.java:42)
+
+
+A detailed walkthrough of the error, its code path and all known details is as follows:
+---------------------------------------------------------------------------------------
+
+-- Head --
+Thread: Server thread
+Stacktrace:
+"""
+
+sections = """
+-- Block entity being ticked --
+Details:
+\tName: minecraft:chest // net.minecraft.ChestTileEntity
+\tBlock: Block{minecraft:chest}
+Stacktrace:
+\tat net.minecraft.World.tick(World.java:1)
+
+-- Affected level --
+Details:
+\tLevel name: world
+\tAll players: 3 total
+
+-- Sponge PhaseTracker --
+Details:
+\tPhase Stack: [Empty stack]
+\tEntries: 3
+
+-- System Details --
+Details:
+\tMinecraft Version: 1.12.2
+
+-- Thread Dump --
+Thread dump:
+"Server thread" prio=5 RUNNABLE
+\tat java.lang.Thread.sleep(Native Method)
+
+"""
+
+_frame = b'\tat net.minecraft.Recursive.call(Recursive.java:42)\n'
+_chunk = _frame * 20000
+
+# Name, size in MiB, with sections, overlong line in bytes.
+corpus = (
+    ('r108.txt', 108, True, 0),
+    ('r300.txt', 300, True, 10_000_000),
+    ('r1g.txt', 1024, True, 0),
+    ('r300bare.txt', 300, False, 0),
+)
+
+
+def genreport(path, mib, withsections=True, longline=0):
+    """Writes a report of about mib MiB to path, its sections at the end."""
+
+    size = mib << 20
+    with open(path, 'wb') as f:
+        f.write(head.encode())
+        while f.tell() + len(_chunk) <= size:
+            f.write(_chunk)
+        f.write(_frame * ((size - f.tell()) // len(_frame)))
+        if longline:
+            f.write(b'X' * longline + b'\n')
+        if withsections:
+            f.write(sections.encode())
+
+
+def gencorpus(dirpath):
+    """Writes all reports of the corpus not present in dirpath yet,
+    returns their paths along with whether they have sections.
+    """
+
+    reports = []
+    for name, mib, withsections, longline in corpus:
+        path = os.path.join(dirpath, name)
+        if not os.path.exists(path):
+            genreport(path, mib, withsections, longline)
+        reports.append((path, withsections))
+    return reports
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+    os.makedirs(sys.argv[1], exist_ok=True)
+    for path, _ in gencorpus(sys.argv[1]):
+        print(path, os.path.getsize(path))
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from fakercon import FakeRcon
+from minecraftcogs.utils import mcservutils
+from minecraftcogs.utils.rcon import RconPool, rconException, rconNoResponse, closeRconPools
+
+
+def run(loop, coro):
+    return loop.run_until_complete(coro)
+
+
+@pytest.fixture
+def fake(loop):
+    fake = run(loop, FakeRcon(loop).start())
+    yield fake
+    run(loop, fake.stop())
+
+
+@pytest.fixture
+def pool(loop, fake):
+    pool = RconPool('127.0.0.1', fake.port, 'secret', loop, timeout=1)
+    yield pool
+    pool.close()
+
+
+def test_roundtrip(loop, fake, pool):
+    fake.responses['list'] = 'There are 0 of a max 20 players online: '
+    assert run(loop, pool.command('list')) == 'There are 0 of a max 20 players online: '
+    assert run(loop, pool.command('say hi')) == 'say hi'
+    assert fake.ran == ['list', 'say hi']
+    assert fake.logins == 1
+
+
+def test_colorcodes_stripped(loop, fake, pool):
+    fake.responses['list'] = '§6There are §c0§6 players'
+    assert run(loop, pool.command('list')) == 'There are 0 players'
+
+
+@pytest.mark.parametrize('size', [4095, 4096, 4097, 3 * 4096, 10000])
+def test_multipacket(loop, fake, pool, size):
+    fake.responses['help'] = ''.join(chr(ord('a') + i % 26) for i in range(size))
+    assert run(loop, pool.command('help')) == fake.responses['help']
+    # The terminator was consumed, the next response is not mixed up.
+    assert run(loop, pool.command('after')) == 'after'
+
+
+def test_empty_response(loop, fake, pool):
+    fake.responses['save-all'] = ''
+    assert run(loop, pool.command('save-all')) == ''
+    assert run(loop, pool.command('after')) == 'after'
+
+
+def test_reconnect(loop, fake, pool):
+    assert run(loop, pool.command('one')) == 'one'
+    fake.drop()
+    run(loop, asyncio.sleep(0.1, loop=loop))
+    assert run(loop, pool.command('two')) == 'two'
+    assert fake.ran == ['one', 'two']
+    assert fake.logins == 2
+
+
+def test_bad_password(loop, fake):
+    pool = RconPool('127.0.0.1', fake.port, 'wrong', loop)
+    with pytest.raises(rconException):
+        run(loop, pool.command('list'))
+    assert fake.ran == []
+
+
+def test_timeout_not_resent(loop, fake, pool):
+    fake.delays['slow'] = 2
+    with pytest.raises(rconNoResponse):
+        run(loop, pool.command('slow'))
+    run(loop, asyncio.sleep(1.5, loop=loop))
+    assert fake.ran == ['slow']
+    assert run(loop, pool.command('fast')) == 'fast'
+
+
+@pytest.fixture
+def screen(monkeypatch):
+    stuffed = []
+
+    async def stuff(loop, server, payload):
+        stuffed.append((server, payload))
+
+    monkeypatch.setattr(mcservutils, '_stuff', stuff)
+    yield stuffed
+    closeRconPools()
+
+
+def test_sendcmds_over_rcon(loop, fake, screen):
+    cfg = {'servers': {'s': {'rconport': fake.port, 'rconpassword': 'secret'}}}
+    assert run(loop, mcservutils.sendCmds(loop, 's', 'a', 'b', servercfg=cfg)) == ['a', 'b']
+    assert screen == []
+
+
+def test_sendcmds_unreachable_falls_back(loop, fake, screen):
+    cfg = {'servers': {'s': {'rconport': fake.port, 'rconpassword': 'wrong'}}}
+    run(loop, mcservutils.sendCmds(loop, 's', 'a', 'b', servercfg=cfg))
+    assert screen == [('s', 'a\rb\r')]
+    assert fake.ran == []
+
+
+def test_sendcmds_timeout_not_resent(loop, fake, screen):
+    cfg = {'servers': {'s': {'rconport': fake.port, 'rconpassword': 'secret'}}}
+    mcservutils.getRconPool('s', cfg, loop).timeout = 1
+    fake.delays['save-all'] = 2
+    run(loop, mcservutils.sendCmds(loop, 's', 'say bye', 'save-all', 'stop', servercfg=cfg))
+    assert fake.ran == ['say bye', 'save-all']
+    assert screen == [('s', 'stop\r')]